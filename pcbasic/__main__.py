@@ -6,4 +6,7 @@ This file is released under the GNU GPL version 3 or later.
 """
 
 from .main import main
-main()
+
+# guard needed for multiprocessing on Windows
+if __name__ == '__main__':
+    main()
@@ -11,9 +11,15 @@ import math
 import struct
 import logging
 import string
+import binascii
 from chunk import Chunk
 import io
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from .base import error
 from .base import tokens as tk
 from . import devices
@@ -54,6 +60,8 @@ class CASDevice(object):
 
     # control characters not allowed in file name on tape
     _illegal_chars = set(map(chr, range(0x20)))
+    # extension of the header index cached alongside the tape image
+    _index_ext = '.idx'
 
     def __init__(self, arg, screen):
         """Initialise tape device."""
@@ -66,6 +74,11 @@ class CASDevice(object):
         self.is_quiet = False
         # console for messages
         self.screen = screen
+        # index of file headers on tape, built on first search
+        self.image_name = val
+        self.index = None
+        # once we've written to the tape, the image on disk may lag behind buffered writes
+        self._written = False
         try:
             if not val:
                 self.tapestream = None
@@ -97,6 +110,9 @@ class CASDevice(object):
             raise error.RunError(error.BAD_FILE_NUMBER)
         try:
             if mode == 'O':
+                # writing changes the tape, so the index is out of date
+                self.index = None
+                self._written = True
                 self.tapestream.open_write(param, filetype, seg, offset, length)
             elif mode == 'I':
                 _, filetype, seg, offset, length = self._search(param, filetype)
@@ -113,6 +129,10 @@ class CASDevice(object):
 
     def _search(self, trunk_req=None, filetypes_req=None):
         """Play until a file header record is found for the given filename."""
+        if trunk_req:
+            found = self._search_index(trunk_req, filetypes_req)
+            if found:
+                return found
         try:
             while True:
                 trunk, filetype, seg, offset, length = self.tapestream.open_read()
@@ -135,6 +155,105 @@ class CASDevice(object):
             # timeout error to align with GW-BASIC behaviour
             raise error.RunError(error.DEVICE_TIMEOUT)
 
+    def _search_index(self, trunk_req, filetypes_req):
+        """Wind the tape to the header of the given file using the index."""
+        position = self.tapestream.counter()
+        if self.index is None:
+            # the cached index can't be trusted against buffered writes
+            if not self._written:
+                self.index = self._load_index()
+            if self.index is None:
+                self.index = self._build_index()
+                # building the index has played the tape through
+                self.tapestream.wind(position)
+        # headers not yet passed: their record ends beyond the current position
+        remaining = [header for header in self.index if header[1] > position]
+        for i, (counter, end, trunk, filetype, seg, offset, length) in enumerate(remaining):
+            if (trunk.rstrip() == trunk_req.rstrip() and
+                    (not filetypes_req or filetype in filetypes_req)):
+                break
+        else:
+            # no such file in the index; play through to be sure
+            return None
+        for skipped in remaining[:i]:
+            message = "%s Skipped." % (skipped[2] + '.' + skipped[3])
+            if not self.is_quiet:
+                self.screen.write_line(message)
+            logging.debug(timestamp(skipped[0]) + message)
+        # the search for the header may have started before the current position
+        # in which case we play on from here; we never wind back
+        counter = max(counter, position)
+        try:
+            if counter > position:
+                self.tapestream.wind(counter)
+            found = self.tapestream.open_read()
+        except (EndOfTape, EnvironmentError):
+            found = None
+        if found != (trunk, filetype, seg, offset, length):
+            # index doesn't match the tape; fall back to playing through
+            logging.debug('Tape index for %s is out of date.', self.image_name)
+            self.index = []
+            self.tapestream.close()
+            self.tapestream.wind(counter)
+            return None
+        message = "%s Found." % (trunk + '.' + filetype)
+        if not self.is_quiet:
+            self.screen.write_line(message)
+        logging.debug(timestamp(counter) + message)
+        return found
+
+    def _build_index(self):
+        """Play the whole tape and record the position of all file headers."""
+        index = []
+        try:
+            self.tapestream.wind(0)
+            while True:
+                header = self.tapestream.open_read()
+                # where the search for the header started, and where the header ends
+                index.append((self.tapestream.header_counter, self.tapestream.counter()) + header)
+                self.tapestream.close()
+        except EndOfTape:
+            pass
+        except EnvironmentError as e:
+            # damaged tape; play through instead
+            logging.debug('Could not index tape %s: %s', self.image_name, e)
+            self.tapestream.close()
+            return []
+        if not self._written:
+            self._save_index(index)
+        return index
+
+    def _get_index_key(self):
+        """Size and modification time of the tape image."""
+        stat = os.stat(self.image_name)
+        return '%d %r' % (stat.st_size, stat.st_mtime)
+
+    def _load_index(self):
+        """Read the header index cached alongside the tape image."""
+        try:
+            with open(self.image_name + self._index_ext, 'rb') as f:
+                if f.readline().rstrip('\n') != self._get_index_key():
+                    return None
+                index = []
+                for line in f:
+                    counter, end, trunk, filetype, seg, offset, length = line.rstrip('\n').split('\t')
+                    index.append((float(counter), float(end), trunk.decode('hex'), filetype,
+                                  int(seg), int(offset), int(length)))
+                return index
+        except (EnvironmentError, ValueError, TypeError):
+            return None
+
+    def _save_index(self, index):
+        """Write the header index alongside the tape image."""
+        try:
+            with open(self.image_name + self._index_ext, 'wb') as f:
+                f.write(self._get_index_key() + '\n')
+                for counter, end, trunk, filetype, seg, offset, length in index:
+                    f.write('%r\t%r\t%s\t%s\t%d\t%d\t%d\n' % (
+                            counter, end, trunk.encode('hex'), filetype, seg, offset, length))
+        except EnvironmentError as e:
+            logging.debug('Could not write tape index for %s: %s', self.image_name, e)
+
     def quiet(self, is_quiet):
         """Suppress Skipped and Found messages."""
         self.is_quiet = is_quiet
@@ -192,6 +311,8 @@ class CassetteStream(object):
         self.length = 0
         self.filetype = ''
         self.rwmode = ''
+        # tape position before the last file header read
+        self.header_counter = 0
 
     def close(self):
         """Finalise the track on the tape stream."""
@@ -217,6 +338,8 @@ class CassetteStream(object):
         return self.bitstream.counter()
 
     def wind(self, loc):
+        """Wind the tape to a position in seconds."""
+        self.bitstream.switch_mode('r')
         self.bitstream.wind(loc)
 
     def write(self, c):
@@ -249,6 +372,7 @@ class CassetteStream(object):
         self.bitstream.switch_mode('r')
         self.rwmode = 'r'
         while True:
+            self.header_counter = self.bitstream.counter()
             record = self._read_record(None)
             if record and record[0] == '\xa5':
                 break
@@ -321,18 +445,9 @@ class CassetteStream(object):
 
     def _read_block(self):
         """Read a block of data from tape."""
-        count = 0
-        data = ''
-        while True:
-            if count == 256:
-                break
-            byte = self.bitstream.read_byte()
-            if byte is None:
-                raise PulseError()
-            data += chr(byte)
-            count += 1
-        bytes0, bytes1 = self.bitstream.read_byte(), self.bitstream.read_byte()
-        crc_given = bytes0 * 0x100 + bytes1
+        data = self.bitstream.read_bytes(256)
+        # crc is written big-endian
+        crc_given, = struct.unpack('>H', self.bitstream.read_bytes(2))
         crc_calc = crc(data)
         # if crc for either polarity matches, return that
         if crc_given == crc_calc:
@@ -344,13 +459,8 @@ class CassetteStream(object):
         """Write a 256-byte block to tape."""
         # fill out short blocks with last byte
         data += data[-1]*(256-len(data))
-        for b in data:
-            self.bitstream.write_byte(ord(b))
-        crc_word = crc(data)
         # crc is written big-endian
-        lo, hi = map(ord, struct.pack('<H', crc_word))
-        self.bitstream.write_byte(hi)
-        self.bitstream.write_byte(lo)
+        self.bitstream.write_bytes(data + struct.pack('>H', crc(data)))
 
     def _fill_record_buffer(self):
         """Read to fill the tape buffer."""
@@ -485,8 +595,7 @@ class TapeBitStream(object):
 
     def write_leader(self):
         """Write the leader / pilot tone."""
-        for _ in range(256):
-            self.write_byte(0xff)
+        self.write_bytes('\xff' * 256)
         self.write_bit(0)
         self.write_byte(0x16)
 
@@ -507,6 +616,15 @@ class TapeBitStream(object):
         for bit in bits:
             self.write_bit(bit)
 
+    def read_bytes(self, nbytes):
+        """Read a string of bytes from the tape."""
+        return ''.join(chr(self.read_byte()) for _ in xrange(nbytes))
+
+    def write_bytes(self, data):
+        """Write a string of bytes to the tape."""
+        for byte in bytearray(data):
+            self.write_byte(byte)
+
     def close(self):
         """Eject tape."""
         pass
@@ -605,14 +723,41 @@ class CASBitStream(TapeBitStream):
         self.mask >>= 1
         if self.mask <= 0:
             self.current_byte = self.cas.read(1)
-            if not self.current_byte:
-                raise EndOfTape
             self.mask = 0x80
+        if not self.current_byte:
+            # also if wound to the end of the tape
+            raise EndOfTape
         if (ord(self.current_byte) & self.mask == 0):
             return 0
         else:
             return 1
 
+    def read_byte(self, skip_start=False):
+        """Read a byte from the tape."""
+        # NOTE: skip_start is ignored
+        return ord(self.read_bytes(1))
+
+    def read_bytes(self, nbytes):
+        """Read a string of bytes from the tape."""
+        if self.mask == 0x100:
+            # current byte has not been read from
+            data = self.current_byte + self.cas.read(nbytes-1)
+            self.mask = 1
+        else:
+            data = self.cas.read(nbytes)
+        if len(data) < nbytes:
+            raise EndOfTape
+        if self.mask != 1:
+            # not byte-aligned: shift in the remaining bits of the current byte
+            # number of unread bits in the current byte
+            shift = _mask_bits[self.mask]
+            bits = int((self.current_byte + data).encode('hex'), 16) >> shift
+            self.current_byte = data[-1]
+            data = ('%0*x' % (2*nbytes, bits & ((1 << 8*nbytes) - 1))).decode('hex')
+        else:
+            self.current_byte = data[-1]
+        return data
+
     def write_bit(self, bit):
         """Write a bit to tape."""
         # note that CAS-files aren't necessarily byte aligned
@@ -624,6 +769,31 @@ class CASBitStream(TapeBitStream):
             self.mask = 0x80
         self.current_byte = chr(ord(self.current_byte) | (bit*self.mask))
 
+    def write_byte(self, byte):
+        """Write a byte to tape image."""
+        self.write_bytes(chr(byte))
+
+    def write_bytes(self, data):
+        """Write a string of bytes to tape."""
+        if not data:
+            return
+        if self.mask == 0x100:
+            # no bits are waiting to be written
+            self.cas.write(data[:-1])
+            self.current_byte = data[-1]
+            self.mask = 1
+        elif self.mask == 1:
+            # byte-aligned: the current byte is complete
+            self.cas.write(self.current_byte + data[:-1])
+            self.current_byte = data[-1]
+        else:
+            # not byte-aligned: shift the bits to follow those in the current byte
+            # number of unwritten bits in the current byte
+            shift = _mask_bits[self.mask]
+            bits = ((ord(self.current_byte) >> shift) << 8*len(data)) | int(data.encode('hex'), 16)
+            self.cas.write(('%0*x' % (2*len(data), bits >> (8-shift))).decode('hex'))
+            self.current_byte = chr((bits << shift) & 0xff)
+
     def flush(self):
         """Write remaining bits to tape."""
         if self.operating_mode == 'w':
@@ -746,6 +916,7 @@ class WAVBitStream(TapeBitStream):
             self.wav = open(self.filename, 'wb')
             self._write_wav_header()
             self.operating_mode = 'w'
+            self.is_changed = True
         else:
             # open file for reading and find wave parameters
             try:
@@ -755,8 +926,10 @@ class WAVBitStream(TapeBitStream):
             if not self._read_wav_header():
                 raise EndOfTape()
             self.operating_mode = 'r'
+            self.is_changed = False
         self.wav_pos = 0
-        self.buf_len = 1024
+        # number of frames read at once; the numpy decoder uses large blocks
+        self.buf_len = 65536 if numpy else 1024
         # convert 8-bit and 16-bit values to ints
         if self.sampwidth == 1:
             self.sub_threshold = 0
@@ -799,6 +972,8 @@ class WAVBitStream(TapeBitStream):
     def switch_mode(self, mode):
         """Switch tape to reading or writing mode."""
         self.operating_mode = mode
+        if mode == 'w':
+            self.is_changed = True
 
     def counter(self):
         """Time stamp in seconds."""
@@ -807,7 +982,9 @@ class WAVBitStream(TapeBitStream):
     def wind(self, loc):
         """Set position of tape in seconds."""
         self.wav_pos = int(loc * self.framerate)
-        self.wav.seek(self.wav_pos)
+        self.wav.seek(self.start + self.wav_pos * self.nchannels * self.sampwidth)
+        # drop frames buffered from the old position
+        self.read_half = self._gen_read_halfpulse()
 
     def read_bit(self):
         """Read the next bit."""
@@ -827,6 +1004,9 @@ class WAVBitStream(TapeBitStream):
     def close(self):
         """Close WAV-file."""
         TapeBitStream.close(self)
+        if not self.is_changed:
+            self.wav.close()
+            return
         # write file length fields
         self.wav.seek(0, 2)
         end_pos = self.wav.tell()
@@ -851,6 +1031,12 @@ class WAVBitStream(TapeBitStream):
         return self.filter.send(frames)
 
     def _gen_read_halfpulse(self):
+        """Return a generator that reads half-pulses and yields their lengths."""
+        if numpy:
+            return self._gen_read_halfpulse_block()
+        return self._gen_read_halfpulse_sample()
+
+    def _gen_read_halfpulse_sample(self):
         """Generator to read a half-pulse and yield its length."""
         length = 0
         frame = 1
@@ -874,6 +1060,51 @@ class WAVBitStream(TapeBitStream):
                 yield length
                 length = 0
 
+    def _fill_buffer_block(self):
+        """Fill buffer with frames and pre-process into a numpy array."""
+        frames = self.wav.read(self.buf_len*self.nchannels*self.sampwidth)
+        # drop any incomplete frame at the end of the file
+        frames = frames[:len(frames) - len(frames) % (self.nchannels*self.sampwidth)]
+        if not frames:
+            raise EndOfTape
+        # take MSBs and sum over channels, as in _fill_buffer
+        msb = numpy.frombuffer(frames, numpy.uint8)[self.sampwidth-1::self.sampwidth]
+        samples = msb.reshape(-1, self.nchannels).sum(axis=1, dtype=numpy.int32)
+        samples = numpy.where(samples >= self.sub_threshold, samples - self.subtractor, samples)
+        return self.filter.send(samples)
+
+    def _gen_read_halfpulse_block(self):
+        """Generator to find half-pulses in blocks of frames and yield their lengths."""
+        # sign of the last frame and of the last nonzero frame
+        frame = 1
+        prezero = 1
+        # frames since the last half-pulse ended
+        length = 0
+        while True:
+            samples = self._fill_buffer_block()
+            # -1, 0 or 1 for below, near or above zero
+            signs = ((samples > self.zero_threshold).astype(numpy.int8) +
+                     (samples >= -self.zero_threshold) - 1)
+            ext = numpy.concatenate(([frame], signs))
+            # fill zero frames with the sign of the last nonzero frame
+            nonzero_pos = numpy.maximum.accumulate(
+                numpy.where(ext != 0, numpy.arange(len(ext)), -1))
+            filled = numpy.where(nonzero_pos >= 0, ext[nonzero_pos], prezero)
+            # a change of sign ends a half-pulse, except where the signal
+            # leaves zero to the opposite sign of the last nonzero frame
+            last = ext[:-1]
+            edges = numpy.flatnonzero(
+                (last != signs) & ((last != 0) | (signs == filled[:-1])))
+            if len(edges):
+                lengths = numpy.diff(numpy.concatenate(([-1-length], edges)))
+                for half in lengths.tolist():
+                    self.wav_pos += half
+                    yield half
+                length = len(signs) - 1 - edges[-1]
+            else:
+                length += len(signs)
+            frame, prezero = signs[-1], filled[-1]
+
     def write_pause(self, milliseconds):
         """Write a pause of given length to the tape."""
         length = (milliseconds * self.framerate / 1000)
@@ -994,17 +1225,11 @@ class WAVBitStream(TapeBitStream):
 def crc(data):
     """Calculate 16-bit CRC-16-CCITT for data."""
     # see http://en.wikipedia.org/wiki/Computation_of_cyclic_redundancy_checks
-    # for a lookup table version, see e.g. WAV2CAS v1.3 for Poisk PC. by Tronix (C) 2013
-    # however, speed is not critical for this function
-    rem = 0xffff
-    for d in bytearray(data):
-        rem ^= d << 8
-        for _ in range(8):
-            rem <<= 1
-            if rem & 0x10000:
-                rem ^= 0x1021
-            rem &= 0xffff
-    return rem ^ 0xffff
+    # binascii.crc_hqx is the table-driven CRC-CCITT with polynomial 0x1021
+    return binascii.crc_hqx(data, 0xffff) ^ 0xffff
+
+# number of bits below the bit mask of CASBitStream
+_mask_bits = dict((1 << _i, _i) for _i in range(9))
 
 def hms(seconds):
     """Return elapsed cassette time at given frame."""
@@ -167,6 +167,10 @@ class CodecStream(object):
         self._stream.write(self._uniconv.to_unicode(bytes(s)).encode(
                     self._encoding, b'replace'))
 
+    def flush(self):
+        """Flush the codec stream."""
+        self._stream.flush()
+
 
 ########################################
 # box drawing protection
@@ -6,6 +6,7 @@ Convert tokenised to plain-text format
 This file is released under the GNU GPL version 3 or later.
 """
 
+import re
 import string
 import struct
 
@@ -16,28 +17,60 @@ from .. import values
 class Lister(object):
     """BASIC detokeniser."""
 
+    # maximum number of formatted number tokens to remember
+    max_cached_numbers = 4096
+    # bytes that start a number token
+    _number_leads = tk.NUMBER + tk.LINE_NUMBER
+    # run of ASCII passed through unchanged
+    _plain_run = re.compile(b'[\x20\x21\x23-\x7e]+')
+    # run of bytes passed through unchanged inside a string literal or comment
+    _literal_run = re.compile(b'[^\0"%s]+' % re.escape(b''.join(_number_leads)))
+    # characters that are separated by a space from a following keyword
+    _alphanumeric = frozenset(string.digits + string.ascii_letters)
+    # tokens after which no space is inserted before a following token or number
+    _no_space_after = frozenset(tk.OPERATOR + (tk.TAB, tk.SPC, tk.USR, tk.FN))
+    # characters before which no space is inserted after a keyword
+    _no_space_before = frozenset(tk.END_LINE + tk.OPERATOR + (
+            tk.O_REM, '"', ',', ';', ' ', ':', '(', ')', '$',
+            '%', '!', '#', '_', '@', '~', '|', '`'))
+
     def __init__(self, values, token_dict):
         """Initialise tokeniser."""
         self._values = values
         self._token_to_keyword = token_dict.to_keyword
+        # formatted number tokens, by token bytes
+        self._numbers = {}
 
     def detokenise_line(self, ins, bytepos=None):
         """Convert a tokenised program line to ascii text."""
-        current_line = self.detokenise_line_number(ins)
+        current_line, line, textpos, pos = self.detokenise_line_at(ins.getvalue(), ins.tell(), bytepos)
+        ins.seek(pos)
+        return current_line, line, textpos
+
+    def detokenise_lines(self, code, positions):
+        """Generate the text of the program lines starting at the given positions in the bytecode."""
+        for pos in positions:
+            _, line, _, _ = self.detokenise_line_at(code, pos)
+            yield str(line)
+
+    def detokenise_line_at(self, code, pos, bytepos=None):
+        """Convert the tokenised program line at a position in a bytecode string to ascii text."""
+        current_line = self.token_to_line_number(code[pos:pos+4])
         if current_line < 0:
-            # detokenise_line_number has returned -1 and left us at: .. 00 | _00_ 00 1A
             # stream ends or end of file sequence \x00\x00\x1A
-            return -1, '', 0
-        elif current_line == 0 and ins.peek() == ' ':
+            # leave the position at the start of the line number: .. 00 | _00_ 00 1A
+            return -1, '', 0, pos
+        pos += 4
+        if current_line == 0 and code[pos:pos+1] == ' ':
             # ignore up to one space after line number 0
-            ins.read(1)
+            pos += 1
         linum = bytearray(str(current_line))
         # write one extra whitespace character after line number
         # unless first char is TAB
-        if ins.peek() != '\t':
+        if code[pos:pos+1] != '\t':
             linum += bytearray(' ')
-        line, textpos = self.detokenise_compound_statement(ins, bytepos)
-        return current_line, linum + line, textpos + len(linum) + 1
+        line, textpos, pos = self._detokenise_statements(code, pos, bytepos)
+        return current_line, linum + line, textpos + len(linum) + 1, pos
 
     def detokenise_line_number(self, ins):
         """Parse line number and leave pointer at first char of line."""
@@ -56,12 +89,26 @@ class Lister(object):
 
     def detokenise_compound_statement(self, ins, bytepos=None):
         """Detokenise tokens until end of line."""
+        output, textpos, pos = self._detokenise_statements(ins.getvalue(), ins.tell(), bytepos)
+        ins.seek(pos)
+        return output, textpos
+
+    def _detokenise_statements(self, code, pos, bytepos):
+        """Detokenise tokens from a position in a bytecode string until end of line."""
         litstring, comment = False, False
         textpos = 0
         output = bytearray()
         while True:
-            s = ins.read(1)
-            if not textpos and ins.tell() >= bytepos:
+            # pass runs of unchanged characters at once
+            # unless we still need to find the text position character by character
+            if bytepos is None or textpos:
+                match = (self._literal_run if comment or litstring else self._plain_run).match(code, pos)
+                if match:
+                    output += match.group()
+                    pos = match.end()
+            s = code[pos:pos+1]
+            pos += len(s)
+            if not textpos and bytepos is not None and pos >= bytepos:
                 textpos = len(output)
             if s in tk.END_LINE:
                 # \x00 ends lines and comments when listed,
@@ -75,8 +122,8 @@ class Lister(object):
                 # even inside comments & literals
                 output += s
                 litstring = not litstring
-            elif s in tk.NUMBER or s in tk.LINE_NUMBER:
-                self._detokenise_number(ins, s, output)
+            elif s in self._number_leads:
+                pos = self._detokenise_number(code, pos, s, output)
             elif comment or litstring or ('\x20' <= s <= '\x7E'):
                 # honest ASCII
                 output += s
@@ -87,45 +134,41 @@ class Lister(object):
                 # controls that do not double as tokens
                 output += s
             else:
-                ins.seek(-1, 1)
-                comment = self._detokenise_keyword(ins, output)
-        return output, textpos
+                comment, pos = self._detokenise_keyword(code, pos-1, output)
+        return output, textpos, pos
 
-    def _detokenise_keyword(self, ins, output):
+    def _detokenise_keyword(self, code, pos, output):
         """Convert a one- or two-byte keyword token to ascii."""
         # try for single-byte token or two-byte token
         # if no match, first char is passed unchanged
-        s = ins.read(1)
+        s = code[pos]
+        pos += 1
         try:
             keyword = self._token_to_keyword[s]
         except KeyError:
-            s += ins.peek()
+            s += code[pos:pos+1]
             try:
                 keyword = self._token_to_keyword[s]
-                ins.read(1)
+                pos += 1
             except KeyError:
                 output += s[0]
-                return False
+                return False, pos
         # when we're here, s is an actual keyword token.
         # letter or number followed by token is separated by a space
-        if (output and chr(output[-1]) in (string.digits + string.ascii_letters) and s not in tk.OPERATOR):
+        if (output and chr(output[-1]) in self._alphanumeric and s not in tk.OPERATOR):
             output += ' '
         output += keyword
         comment = False
         if keyword == "'":
             comment = True
         elif keyword == tk.KW_REM:
-            nxt = ins.read(1)
-            if nxt == '':
-                pass
-            elif nxt == tk.O_REM: # '
+            if code[pos:pos+1] == tk.O_REM: # '
                 # if next char is token('), we have the special value REM'
                 # -- replaced by ' below.
                 output += "'"
-            else:
-                # otherwise, it's part of the comment or an EOL or whatever,
-                # pass back to stream so it can be processed
-                ins.seek(-1, 1)
+                pos += 1
+            # otherwise, it's part of the comment or an EOL or whatever,
+            # leave it to be processed
             comment = True
         # check for special cases
         #   [:REM']   ->  [']
@@ -146,35 +189,44 @@ class Lister(object):
                 output[:] = output[:-5] + tk.KW_ELSE
         # token followed by token or number is separated by a space,
         # except operator tokens and SPC(, TAB(, FN, USR
-        nxt = ins.peek()
-        if (not comment and
-                nxt not in tk.END_LINE + tk.OPERATOR +
-                        (tk.O_REM, '"', ',', ';', ' ', ':', '(', ')', '$',
-                         '%', '!', '#', '_', '@', '~', '|', '`') and
-                s not in tk.OPERATOR + (tk.TAB, tk.SPC, tk.USR, tk.FN)):
+        if (not comment and code[pos:pos+1] not in self._no_space_before and
+                s not in self._no_space_after):
             # excluding TAB( SPC( and FN. \xD9 is ', \xD1 is FN, \xD0 is USR.
             output += ' '
-        return comment
+        return comment, pos
 
-    def _detokenise_number(self, ins, lead, output):
+    def _detokenise_number(self, code, pos, lead, output):
         """Convert number token to Python string."""
         ntrail = tk.PLUS_BYTES.get(lead, 0)
-        trail = ins.read(ntrail)
+        trail = code[pos:pos+ntrail]
+        pos += len(trail)
         if len(trail) != ntrail:
             # not sure what GW does if the file is truncated here - we just stop
-            return
+            return pos
+        try:
+            output += self._numbers[lead + trail]
+        except KeyError:
+            if len(self._numbers) >= self.max_cached_numbers:
+                self._numbers.clear()
+            text = self._number_to_str(lead, trail)
+            self._numbers[lead + trail] = text
+            output += text
+        return pos
+
+    def _number_to_str(self, lead, trail):
+        """Format the value of a number token."""
         if lead == tk.T_OCT:
-            output += b'&O' + self._values.from_bytes(trail).to_oct()
+            return b'&O' + self._values.from_bytes(trail).to_oct()
         elif lead == tk.T_HEX:
-            output += b'&H' + self._values.from_bytes(trail).to_hex()
+            return b'&H' + self._values.from_bytes(trail).to_hex()
         elif lead == tk.T_BYTE:
-            output += str(ord(trail))
+            return str(ord(trail))
         elif tk.C_0 <= lead <= tk.C_10:
-            output += str(ord(lead) - ord(tk.C_0))
+            return str(ord(lead) - ord(tk.C_0))
         elif lead in tk.LINE_NUMBER:
             # 0D: line pointer (unsigned int) - this token should not be here;
             #     interpret as line number and carry on
             # 0E: line number (unsigned int)
-            output += str(struct.unpack(b'<H', trail)[0])
+            return str(struct.unpack(b'<H', trail)[0])
         elif lead in (tk.T_SINGLE, tk.T_DOUBLE, tk.T_INT):
-            output += self._values.from_bytes(trail).to_str(leading_space=False, type_sign=True)
+            return self._values.from_bytes(trail).to_str(leading_space=False, type_sign=True)
@@ -6,6 +6,7 @@ Convert plain-text BASIC code to tokenised form
 This file is released under the GNU GPL version 3 or later.
 """
 
+import re
 import string
 import struct
 import io
@@ -63,10 +64,28 @@ class Tokeniser(object):
     # operator symbols
     _ascii_operators = '+-=/\\^*<>'
 
+    # keywords that are tokenised even if followed by more name characters
+    _prefix_keywords = (tk.KW_FN, tk.KW_SPC, tk.KW_TAB, tk.KW_USR)
+
+    # runs of characters that can be consumed at once
+    _name_run = re.compile('[A-Za-z0-9.]+')
+    _digit_run = re.compile('[0-9]+')
+    _blank_run = re.compile('[ \t\n]+')
+    _string_literal = re.compile('"[^"\0\r]*"?')
+    _rem_text = re.compile('[^\0\r]*')
+    _data_text = re.compile('[^\0\r:"]*')
+    # an integer literal that can't continue as any other kind of number
+    _integer = re.compile('[0-9]+(?![0-9 \t\n.EeDd!#%\x1c\x1d\x1f])')
+
     def __init__(self, values, keyword_dict):
         """Initialise tokeniser."""
         self._values = values
         self._keyword_to_token = keyword_dict.to_token
+        # prefix keywords that consist of name characters, shortest first
+        self._name_prefixes = sorted(
+                (kw for kw in self._prefix_keywords
+                    if kw in self._keyword_to_token and self._name_run.match(kw).end() == len(kw)),
+                key=len)
 
     def tokenise_line(self, line):
         """Convert an ascii program line to tokenised form."""
@@ -77,8 +96,10 @@ class Tokeniser(object):
         if d == '':
             # empty line at EOF
             return outs
+        # scan the line by position
+        s, pos = ins.getvalue(), ins.tell()
         # read the line number
-        self._tokenise_line_number(ins, outs)
+        pos = self._tokenise_line_number(ins, s, pos, outs)
         # expect line number
         allow_jumpnum = False
         # expect number (6553 6 -> the 6 is encoded as \x17)
@@ -88,25 +109,22 @@ class Tokeniser(object):
         # parse through elements of line
         while True:
             # peek next character
-            c = ins.peek()
+            c = s[pos:pos+1]
             # anything after NUL is ignored till EOL
             if c == '\0':
-                ins.read(1)
-                ins.read_to(('', '\r'))
                 break
             # end of line
             elif c in ('', '\r'):
                 break
             # handle whitespace
             elif c in ins.blanks:
-                ins.read(1)
-                outs.write(c)
+                pos = self._write_match(self._blank_run, s, pos, outs)
             # handle string literals
-            elif ins.peek() == '"':
-                outs.write(ins.read_string())
+            elif c == '"':
+                pos = self._write_match(self._string_literal, s, pos, outs)
             # handle jump numbers
             elif allow_number and allow_jumpnum and c in string.digits + '.':
-                self._tokenise_jump_number(ins, outs)
+                pos = self._tokenise_jump_number(ins, s, pos, outs)
             # handle numbers
             # numbers following var names with no operator or token in between
             # should not be parsed, eg OPTION BASE 1
@@ -114,10 +132,19 @@ class Tokeniser(object):
             # number starting with & are always parsed
             elif c in ('&', ) or (allow_number and
                                       not allow_jumpnum and c in string.digits + '.'):
-                outs.write(self.tokenise_number(ins))
+                match = self._integer.match(s, pos)
+                if match:
+                    # plain integer: skip the character-wise number scanner
+                    outs.write(self._values.from_repr(
+                            match.group(), allow_nonnum=False).to_token())
+                    pos = match.end()
+                else:
+                    ins.seek(pos)
+                    outs.write(self.tokenise_number(ins))
+                    pos = ins.tell()
             # operator keywords ('+', '-', '=', '/', '\\', '^', '*', '<', '>'):
             elif c in self._ascii_operators:
-                ins.read(1)
+                pos += 1
                 # operators don't affect line number mode - can do line number
                 # arithmetic and RENUM will do the strangest things
                 # this allows for 'LIST 100-200' etc.
@@ -125,22 +152,21 @@ class Tokeniser(object):
                 allow_number = True
             # special case ' -> :REM'
             elif c == "'":
-                ins.read(1)
                 outs.write(':' + tk.REM + tk.O_REM)
-                self._tokenise_rem(ins, outs)
+                pos = self._write_match(self._rem_text, s, pos+1, outs)
             # special case ? -> PRINT
             elif c == '?':
-                ins.read(1)
+                pos += 1
                 outs.write(tk.PRINT)
                 allow_number = True
             # keywords & variable names
             elif c in string.ascii_letters:
-                word = self._tokenise_word(ins, outs)
+                word, pos = self._tokenise_name(ins, s, pos, outs)
                 # handle non-parsing modes
                 if word in (tk.KW_REM, "'"):
-                    self._tokenise_rem(ins, outs)
+                    pos = self._write_match(self._rem_text, s, pos, outs)
                 elif word == tk.KW_DATA:
-                    self._tokenise_data(ins, outs)
+                    pos = self._tokenise_data(s, pos, outs)
                 else:
                     allow_jumpnum = (word in self._linenum_words)
                     # numbers can follow tokenised keywords
@@ -149,7 +175,7 @@ class Tokeniser(object):
                     if word in (tk.KW_SPC, tk.KW_TAB):
                         spc_or_tab = True
             else:
-                ins.read(1)
+                pos += 1
                 if c in (',', '#', ';'):
                     # can separate numbers as well as jumpnums
                     allow_number = True
@@ -166,23 +192,25 @@ class Tokeniser(object):
         outs.seek(0)
         return outs
 
-    def _tokenise_rem(self, ins, outs):
-        """Pass anything after REM as is till EOL."""
-        outs.write(ins.read_to(('', '\r', '\0')))
+    def _write_match(self, regex, s, pos, outs):
+        """Pass a run of characters matching a pattern as is."""
+        match = regex.match(s, pos)
+        outs.write(match.group())
+        return match.end()
 
-    def _tokenise_data(self, ins, outs):
+    def _tokenise_data(self, s, pos, outs):
         """Pass DATA as is, till end of statement, except for literals."""
         while True:
-            outs.write(ins.read_to(('', '\r', '\0', ':', '"')))
-            if ins.peek() == '"':
+            pos = self._write_match(self._data_text, s, pos, outs)
+            if s[pos:pos+1] == '"':
                 # string literal in DATA
-                outs.write(ins.read_string())
+                pos = self._write_match(self._string_literal, s, pos, outs)
             else:
-                break
+                return pos
 
-    def _tokenise_line_number(self, ins, outs):
+    def _tokenise_line_number(self, ins, s, pos, outs):
         """Convert an ascii line number to tokenised start-of-line."""
-        linenum = ins.read_line_number()
+        linenum, pos = self._read_line_number(ins, s, pos)
         if linenum is not None:
             # NUL terminates last line and fills up the first char in the buffer
             # (that would be the magic number when written to file)
@@ -193,21 +221,86 @@ class Tokeniser(object):
             outs.write('\x00\xC0\xDE' + struct.pack('<H', linenum))
             # ignore single whitespace after line number, if any,
             # unless line number is zero (as does GW)
-            if ins.peek() == ' ' and linenum != 0:
-                ins.read(1)
+            if s[pos:pos+1] == ' ' and linenum != 0:
+                pos += 1
         else:
             # direct line; internally, we need an anchor for the program pointer,
             # so we encode a ':'
             outs.write(':')
+        return pos
 
-    def _tokenise_jump_number(self, ins, outs):
+    def _tokenise_jump_number(self, ins, s, pos, outs):
         """Convert an ascii line number pointer to tokenised form."""
-        linum = ins.read_line_number()
+        linum, pos = self._read_line_number(ins, s, pos)
         if linum is not None:
             outs.write(tk.T_UINT + struct.pack('<H', linum))
-        elif ins.peek() == '.':
-            ins.read(1)
+        elif s[pos:pos+1] == '.':
+            pos += 1
             outs.write('.')
+        return pos
+
+    def _read_line_number(self, ins, s, pos):
+        """Read a line or jump number at a given position, return number and new position."""
+        run = self._digit_run.match(s, pos)
+        if run:
+            # don't read more than 5 digits, or 4 if that's above 6552
+            word = run.group()[:5]
+            if len(word) >= 4 and int(word[:4]) > 6552:
+                word = word[:4]
+            end = pos + len(word)
+            # digits separated by whitespace are read as one number
+            blanks = self._blank_run.match(s, end)
+            after = blanks.end() if blanks else end
+            if len(word) == 5 or int(word) > 6552 or not self._digit_run.match(s, after):
+                return int(word), end
+        elif not self._blank_run.match(s, pos):
+            return None, pos
+        ins.seek(pos)
+        return ins.read_line_number(), ins.tell()
+
+    def _tokenise_name(self, ins, s, pos, outs):
+        """Convert a keyword or name starting at a given position."""
+        # a run of name characters, uppercased
+        word = self._name_run.match(s, pos).group().upper()
+        end = pos + len(word)
+        # GO TO and GO SUB may contain spaces
+        if word[:2] == 'GO' and word not in (tk.KW_GOTO, tk.KW_GOSUB):
+            return self._tokenise_word_at(ins, pos, outs)
+        # FN and USR are tokenised even if they start a longer name
+        for keyword in self._name_prefixes:
+            if word[:len(keyword)] == keyword:
+                self._write_keyword(keyword, outs)
+                return keyword, pos + len(keyword)
+        if word in self._keyword_to_token:
+            self._write_keyword(word, outs)
+            return word, end
+        # keywords such as CHR$ and SPC( end in a non-name character
+        longer = word + s[end:end+1].upper()
+        if longer != word and longer in self._keyword_to_token:
+            if longer in self._prefix_keywords or s[end+1:end+2] not in tk.NAME_CHARS:
+                self._write_keyword(longer, outs)
+                return longer, end + 1
+            return self._tokenise_word_at(ins, pos, outs)
+        outs.write(word)
+        return word, end
+
+    def _tokenise_word_at(self, ins, pos, outs):
+        """Convert a keyword starting at a given position, one character at a time."""
+        ins.seek(pos)
+        word = self._tokenise_word(ins, outs)
+        return word, ins.tell()
+
+    def _write_keyword(self, word, outs):
+        """Write the token for a keyword."""
+        token = self._keyword_to_token[word]
+        # handle special case ELSE -> :ELSE
+        if word == tk.KW_ELSE:
+            outs.write(':' + token)
+        # handle special case WHILE -> WHILE+
+        elif word == tk.KW_WHILE:
+            outs.write(token + tk.O_PLUS)
+        else:
+            outs.write(token)
 
     def _tokenise_word(self, ins, outs):
         """Convert a keyword to tokenised form."""
@@ -236,19 +329,11 @@ class Tokeniser(object):
                         word = 'GO'
             if word in self._keyword_to_token:
                 # ignore if part of a longer name, except FN, SPC(, TAB(, USR
-                if word not in (tk.KW_FN, tk.KW_SPC, tk.KW_TAB, tk.KW_USR):
+                if word not in self._prefix_keywords:
                     nxt = ins.peek()
                     if nxt in tk.NAME_CHARS:
                         continue
-                token = self._keyword_to_token[word]
-                # handle special case ELSE -> :ELSE
-                if word == tk.KW_ELSE:
-                    outs.write(':' + token)
-                # handle special case WHILE -> WHILE+
-                elif word == tk.KW_WHILE:
-                    outs.write(token + tk.O_PLUS)
-                else:
-                    outs.write(token)
+                self._write_keyword(word, outs)
                 break
             # allowed names: letter + (letters, numbers, .)
             elif not c:
@@ -8,6 +8,7 @@ This file is released under the GNU GPL version 3 or later.
 
 import io
 import os
+import re
 import struct
 
 from .base import error
@@ -22,6 +23,13 @@ def nullstream():
 type_to_magic = { 'B': '\xff', 'P': '\xfe', 'M': '\xfd' }
 magic_to_type = { '\xff': 'B', '\xfe': 'P', '\xfd': 'M' }
 
+# nonprinting characters including tabs are not counted for WIDTH
+nonprinting_chars = ''.join(chr(_c) for _c in range(32))
+
+def printing_width(s):
+    """Number of characters in string s that count towards WIDTH."""
+    return len(s.translate(None, nonprinting_chars))
+
 
 
 ############################################################################
@@ -179,6 +187,9 @@ class RawFile(object):
 class TextFileBase(RawFile):
     """Base for text files on disk, KYBD file, field buffer."""
 
+    # size of blocks read ahead from the stream; 0 reads one char at a time
+    read_ahead = 0
+
     def __init__(self, fhandle, filetype, mode,
                  first_char='', split_long_lines=True):
         """Setup the basic properties of the file."""
@@ -198,12 +209,59 @@ class TextFileBase(RawFile):
         # handling of >255 char lines (False for programs)
         self.split_long_lines = split_long_lines
         self.char, self.last = '', ''
+        # read-ahead buffer, starting at next_char
+        self._buffer, self._bufpos = self.next_char, 0
+        self._eof_pos = 0 if self.next_char == '\x1a' else len(self.next_char)
 
     def switch_mode(self, new_mode):
         """Switch to input or output mode"""
 
+    def _tell(self):
+        """Position in the stream, counting next_char as read."""
+        if not self.read_ahead:
+            return self.fhandle.tell()
+        return self.fhandle.tell() - max(0, len(self._buffer) - self._bufpos - 1)
+
+    def _fill_buffer(self, size):
+        """Read ahead from the stream, keeping the unread part of the buffer."""
+        self._buffer = self._buffer[self._bufpos:] + self.fhandle.read(size)
+        self._bufpos = 0
+        # \x1A stops further reading
+        self._eof_pos = self._buffer.find('\x1a')
+        if self._eof_pos < 0:
+            self._eof_pos = len(self._buffer)
+
+    def _advance(self, end):
+        """Consume buffered characters up to end and return them."""
+        s = self._buffer[self._bufpos:end]
+        if len(s) > 1:
+            self.char, self.last = s[-1], s[-2]
+        elif s:
+            self.char, self.last = s, self.char
+        self._bufpos = end
+        if end >= len(self._buffer):
+            self._fill_buffer(self.read_ahead)
+        self.next_char = self._buffer[self._bufpos:self._bufpos+1]
+        return s
+
+    def _read_buffered(self, num):
+        """Read num characters as string through the read-ahead buffer."""
+        if self.next_char in ('\x1a', ''):
+            return ''
+        if num < 0:
+            self._fill_buffer(-1)
+            end = len(self._buffer)
+        else:
+            # make sure we have the char following the ones we return
+            if len(self._buffer) - self._bufpos <= num:
+                self._fill_buffer(max(self.read_ahead, num))
+            end = min(self._bufpos + num, len(self._buffer))
+        return self._advance(min(end, self._eof_pos))
+
     def read_raw(self, num=-1):
         """Read num characters as string."""
+        if self.read_ahead:
+            return self._read_buffered(num)
         s = ''
         while True:
             if (num > -1 and len(s) >= num):
@@ -241,34 +299,24 @@ class TextFileBase(RawFile):
     def write(self, s, can_break=True):
         """Write the string s to the file, taking care of width settings."""
         # only break lines at the start of a new string. width 255 means unlimited width
-        s_width = 0
-        newline = False
+        s = str(s)
         # find width of first line in s
-        for c in str(s):
-            if c in ('\r', '\n'):
-                newline = True
-                break
-            if ord(c) >= 32:
-                # nonprinting characters including tabs are not counted for WIDTH
-                s_width += 1
+        first_line = s.split('\r', 1)[0].split('\n', 1)[0]
+        newline = len(first_line) < len(s)
+        s_width = printing_width(first_line)
         if can_break and self.width != 255 and self.col != 1 and self.col-1 + s_width > self.width and not newline:
             self.write_line()
             self.flush()
             self.col = 1
-        for c in str(s):
-            # don't replace CR or LF with CRLF when writing to files
-            if c in ('\r',):
-                self.fhandle.write(c)
-                self.flush()
-                self.col = 1
-            else:
-                self.fhandle.write(c)
-                # nonprinting characters including tabs are not counted for WIDTH
-                if ord(c) >= 32:
-                    self.col += 1
-                    # col-1 is a byte that wraps
-                    if self.col == 257:
-                        self.col = 1
+        # don't replace CR or LF with CRLF when writing to files
+        self.fhandle.write(s)
+        last_cr = s.rfind('\r')
+        if last_cr >= 0:
+            self.flush()
+            self.col = 1
+            s = s[last_cr+1:]
+        # col-1 is a byte that wraps
+        self.col = (self.col - 1 + printing_width(s)) % 256 + 1
 
     def write_line(self, s=''):
         """Write string or bytearray and follow with CR or CRLF."""
@@ -365,6 +413,12 @@ class TextFileBase(RawFile):
 class CRLFTextFileBase(TextFileBase):
     """Text file with CRLF line endings, on disk device or field buffer."""
 
+    # simple INPUT# entries: no NUL, LF or EOF char, no overlong fields
+    _entry_start = re.compile(' *')
+    _number_entry = re.compile('([^ ,\r\n\0\x1a]{0,254})( *)([,\r]?)')
+    _string_entry = re.compile('([^,\r\n\0\x1a]{0,254})([,\r])')
+    _quoted_entry = re.compile('"((?!\r)[^"\0\x1a]{0,254})"( *)([,\r]?)')
+
     def read(self, num=-1):
         """Read num characters, replacing CR LF with CR."""
         s = ''
@@ -383,6 +437,8 @@ class CRLFTextFileBase(TextFileBase):
 
     def read_line(self):
         """Read line from text file, break on CR or CRLF (not LF)."""
+        if self.read_ahead:
+            return self._read_line_buffered()
         s = ''
         while not self._check_long_line(s):
             c = self.read(1)
@@ -395,6 +451,84 @@ class CRLFTextFileBase(TextFileBase):
             return None
         return s
 
+    def input_entry(self, typechar, allow_past_end):
+        """Read a number or string entry for INPUT """
+        if self.read_ahead and self.soft_sep == ' ':
+            entry = self._input_entry_buffered(typechar)
+            if entry:
+                return entry
+        return TextFileBase.input_entry(self, typechar, allow_past_end)
+
+    def _input_entry_buffered(self, typechar):
+        """Match a simple INPUT# entry in the read-ahead buffer; None if not simple."""
+        if self.next_char in ('', '\x1a'):
+            return None
+        # ensure we have a full entry in the buffer if possible
+        if len(self._buffer) - self._bufpos < 512:
+            self._fill_buffer(self.read_ahead)
+        end = self._eof_pos
+        start = self._entry_start.match(self._buffer, self._bufpos, end).end()
+        if typechar != '$':
+            match = self._number_entry.match(self._buffer, start, end)
+            word, spaces, c = match.groups()
+            if not spaces and not c:
+                return None
+        elif self._buffer.startswith('"', start, end):
+            match = self._quoted_entry.match(self._buffer, start, end)
+            if not match:
+                return None
+            word, spaces, c = match.groups()
+        else:
+            match = self._string_entry.match(self._buffer, start, end)
+            if not match:
+                return None
+            word, c = match.groups()
+            # trailing whitespace is not included in strings
+            word = word.rstrip(' ')
+        if not c:
+            # we need to see what follows the spaces or closing quote
+            if match.end() >= end:
+                return None
+            c = ' ' if typechar != '$' else '"'
+        self._advance(match.end())
+        # report CRLF as CR
+        if c == '\r' and self.last != '\n' and self.next_char == '\n':
+            last, char = self.last, self.char
+            self._advance(self._bufpos + 1)
+            self.last, self.char = last, char
+        # file position is at one past the separator char
+        return word, c
+
+    def _read_line_buffered(self):
+        """Read line through the read-ahead buffer, scanning for CR in bulk."""
+        s, c = '', ''
+        while not self._check_long_line(s):
+            if self.next_char in ('', '\x1a'):
+                c = ''
+                break
+            # scan no further than the maximum line length
+            end = min(self._eof_pos, self._bufpos + 256 - len(s))
+            cr = self._buffer.find('\r', self._bufpos, end)
+            if cr < 0:
+                s += self._advance(end)
+                c = s[-1]
+                continue
+            last = self._buffer[cr-1] if cr > self._bufpos else self.char
+            s += self._advance(cr + 1)
+            c = '\r'
+            if last != '\n':
+                # break on CR, CRLF but allow LF, LFCR to pass
+                s = s[:-1]
+                # report CRLF as CR
+                if self.next_char == '\n':
+                    last, char = self.last, self.char
+                    self._advance(self._bufpos + 1)
+                    self.last, self.char = last, char
+                break
+        if not c and not s:
+            return None
+        return s
+
     def write_line(self, s=''):
         """Write string or bytearray and newline to file."""
         self.write(str(s) + '\r\n')
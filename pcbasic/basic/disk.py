@@ -13,10 +13,16 @@ import os
 import errno
 import logging
 import string
+import time
 import re
 import platform
 import locale
 import struct
+import mmap
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 if platform.system() == b'Windows':
     import win32api
     import ctypes
@@ -184,6 +190,65 @@ def istype(path, native_name, isdir):
         # happens for name = '\0'
         return False
 
+class DirectoryCache(object):
+    """Cache of host directory listings and their DOS names."""
+
+    # maximum number of directories kept
+    max_dirs = 64
+    # listings taken less than this many seconds after a change may be stale
+    # as the change may have happened within the file system's mtime resolution
+    settle_time = 3.
+
+    def __init__(self):
+        """Initialise the cache."""
+        # dict of [mtime, sorted names, split dos names, short names] by path
+        self._dirs = {}
+
+    def _get(self, path):
+        """Retrieve a valid cache entry for a directory, listing it if needed."""
+        path = os.path.abspath(path)
+        mtime = os.stat(path).st_mtime
+        entry = self._dirs.get(path)
+        if entry is None or entry[0] != mtime:
+            now = time.time()
+            names = sorted(os.listdir(path))
+            dosnames = {}
+            for name in names:
+                dosnames.setdefault(split_dosname(name), []).append(name)
+            entry = [mtime, names, dosnames, {}]
+            if now - mtime > self.settle_time:
+                if len(self._dirs) >= self.max_dirs:
+                    self._dirs.clear()
+                self._dirs[path] = entry
+            else:
+                self._dirs.pop(path, None)
+        return entry
+
+    def invalidate(self, path):
+        """Drop the listing of a directory after we change it."""
+        self._dirs.pop(os.path.abspath(path), None)
+
+    def listdir(self, path):
+        """Sorted list of names in a directory."""
+        return self._get(path)[1]
+
+    def match(self, path, trunk, ext):
+        """Sorted list of names in a directory that match a split DOS name."""
+        return self._get(path)[2].get((trunk, ext), ())
+
+    def short_name(self, path, longname):
+        """Get the split short name for a name in a directory."""
+        short_names = self._get(path)[3]
+        try:
+            return short_names[longname]
+        except KeyError:
+            short = short_names[longname] = short_name(path, longname)
+            return short
+
+# cache shared by all disk devices
+dir_cache = DirectoryCache()
+
+
 def match_dosname(dosname, path, isdir):
     """Find a matching native file name for a given 8.3 ascii DOS name."""
     try:
@@ -197,8 +262,8 @@ def match_dosname(dosname, path, isdir):
     # find other case combinations, if present
     # also match training single dot to no dots
     trunk, ext = split_dosname(dosname)
-    for f in sorted(os.listdir(path)):
-        if split_dosname(f) == (trunk, ext) and istype(path, f, isdir):
+    for f in dir_cache.match(path, trunk, ext):
+        if istype(path, f, isdir):
             return f
     return None
 
@@ -264,7 +329,7 @@ def filename_from_unicode(name):
 
 def filter_names(path, files_list, mask=b'*.*'):
     """Apply filename filter to short version of names."""
-    all_files = [short_name(path, name.decode(b'ascii')) for name in files_list]
+    all_files = [dir_cache.short_name(path, name.decode(b'ascii')) for name in files_list]
     # apply mask separately to trunk and extension, dos-style.
     # hide dotfiles
     trunkmask, extmask = split_dosname(mask)
@@ -366,10 +431,16 @@ class DiskDevice(object):
         # don't open output or append files more than once
         if mode in (b'O', b'A'):
             self.check_file_not_open(name)
+        # we may be about to create the file
+        if mode != b'I' and not os.path.exists(name):
+            dir_cache.invalidate(os.path.dirname(name))
         # obtain a lock
         if filetype == 'D':
             self.locks.acquire(name, number, lock, access)
         try:
+            if filetype == 'D':
+                # check for other processes before truncating anything
+                self.locks.acquire_os(name, number, lock, access, create=(mode != b'I'))
             # open the underlying stream
             fhandle = self._open_stream(name, mode, access)
             # apply the BASIC file wrapper
@@ -379,6 +450,9 @@ class DiskDevice(object):
                     seg, offset, length)
             # register file as open
             self.locks.open_file(number, f)
+            if filetype == 'D':
+                # opening the stream may have dropped our OS locks
+                self.locks.refresh(name)
             return f
         except Exception:
             if filetype == 'D':
@@ -488,18 +562,25 @@ class DiskDevice(object):
 
     def mkdir(self, name):
         """Create directory at given BASIC path."""
-        safe(os.mkdir, self._native_path(name, name_err=None, isdir=True))
+        path = self._native_path(name, name_err=None, isdir=True)
+        dir_cache.invalidate(os.path.dirname(path))
+        safe(os.mkdir, path)
 
     def rmdir(self, name):
         """Remove directory at given BASIC path."""
-        safe(os.rmdir, self._native_path(name, name_err=error.PATH_NOT_FOUND, isdir=True))
+        path = self._native_path(name, name_err=error.PATH_NOT_FOUND, isdir=True)
+        dir_cache.invalidate(os.path.dirname(path))
+        safe(os.rmdir, path)
 
     def kill(self, name):
         """Remove regular file at given native path."""
+        dir_cache.invalidate(os.path.dirname(name))
         safe(os.remove, name)
 
     def rename(self, oldname, newname):
         """Rename a file or directory."""
+        dir_cache.invalidate(os.path.dirname(oldname))
+        dir_cache.invalidate(os.path.dirname(newname))
         safe(os.rename, oldname, newname)
 
     def files(self, screen, pathmask):
@@ -525,7 +606,7 @@ class DiskDevice(object):
         elif mask == b'..':
             dirs = [split_dosname((os.sep+relpath).split(os.sep)[-2:][0])]
         else:
-            all_names = safe(os.listdir, path)
+            all_names = safe(dir_cache.listdir, path)
             dirs = [filename_from_unicode(n) for n in all_names if os.path.isdir(os.path.join(path, n))]
             fils = [filename_from_unicode(n) for n in all_names if not os.path.isdir(os.path.join(path, n))]
             # filter according to mask
@@ -572,12 +653,33 @@ class DiskDevice(object):
 class Locks(object):
     """Lock management."""
 
+    # byte-range locks are shared with other processes through fcntl
+    # share modes are signalled through locks on single bytes beyond the last record
+    # only SHARED and LOCK opens hold them; default-mode opens only test for them
+    _share_base = 2**62
+    _share_bytes = {b'AR': 0, b'AW': 1, b'DR': 2, b'DW': 3}
+    # access types denied to other processes by each lock mode
+    _deny = {b'SHARED': b'', b'R': b'R', b'W': b'W', b'RW': b'RW'}
+
     def __init__(self):
         """Initialise locks."""
         # dict of native file names by number, for locking
         self._locks = {}
         # dict of disk files
         self.open_files = {}
+        # OS lock file descriptors by native file name
+        self._fds = {}
+        # native name and share-mode lock bytes held, by file number
+        self._shares = {}
+        # record lock byte ranges, by file number
+        self._ranges = {}
+
+    def __getstate__(self):
+        """Get pickling dict for locks."""
+        pickle_dict = self.__dict__.copy()
+        # file descriptors and OS locks don't survive the process
+        pickle_dict['_fds'], pickle_dict['_shares'], pickle_dict['_ranges'] = {}, {}, {}
+        return pickle_dict
 
     def list(self, name):
         """Retrieve a list of files open to the same disk stream."""
@@ -603,12 +705,137 @@ class Locks(object):
                 raise error.RunError(error.PERMISSION_DENIED)
         self._locks[number] = name
 
+    def acquire_os(self, name, number, lock_type, access, create):
+        """Try to lock a file against other processes, following DOS SHARE rules."""
+        if not number or not fcntl:
+            return
+        fd = self._fds.get(name)
+        if fd is None:
+            try:
+                # default mode holds no locks, so there's no need to create the file for it
+                fd = os.open(name, os.O_RDWR | (os.O_CREAT if create and lock_type else 0), 0o666)
+            except EnvironmentError as e:
+                logging.debug('Could not open %s for locking: %s', name, e)
+                return
+        if lock_type:
+            deny = self._deny[lock_type]
+            # bytes we hold: our access types and denied access types
+            held = [b'A' + c for c in access] + [b'D' + c for c in deny]
+            # bytes no other process may hold
+            tested = [b'D' + c for c in access] + [b'A' + c for c in deny]
+        else:
+            # default (compatibility) mode: refused if another process has the file open
+            # in any sharing mode, as that process denies access or expects to share it
+            held, tested = [], list(self._share_bytes)
+        try:
+            conflict = not all(
+                self._lock_range(fd, fcntl.LOCK_EX, self._share_base + self._share_bytes[b], 1)
+                for b in tested)
+            for b in tested:
+                fcntl.lockf(fd, fcntl.LOCK_UN, 1, self._share_base + self._share_bytes[b])
+        except EnvironmentError as e:
+            logging.debug('Could not lock %s: %s', name, e)
+            conflict = False
+        else:
+            if not conflict and held:
+                self._shares[number] = name, [self._share_bytes[b] for b in held]
+        self._fds[name] = fd
+        # restore our own share-mode locks undone by the test
+        # or close the descriptor if we hold none on this file
+        self.refresh(name)
+        if conflict:
+            raise error.RunError(error.PERMISSION_DENIED)
+
+    def _lock_range(self, fd, lock_type, offset, length):
+        """Try to set an OS lock on a byte range; return False if held by another process."""
+        try:
+            fcntl.lockf(fd, lock_type | fcntl.LOCK_NB, length, offset)
+        except EnvironmentError as e:
+            if e.errno in (errno.EACCES, errno.EAGAIN):
+                return False
+            raise
+        return True
+
+    def refresh(self, name):
+        """Re-apply all our OS locks on a file; closing any of its descriptors drops them."""
+        fd = self._fds.get(name)
+        if fd is None:
+            return
+        numbers = [num for num, (fname, _) in self._shares.iteritems() if fname == name]
+        if not numbers:
+            # no more files open to this stream
+            os.close(fd)
+            del self._fds[name]
+            return
+        try:
+            for num in numbers:
+                for offset in self._shares[num][1]:
+                    fcntl.lockf(fd, fcntl.LOCK_SH | fcntl.LOCK_NB, 1, self._share_base + offset)
+                for offset, length in self._ranges.get(num, ()):
+                    fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB, length, offset)
+        except EnvironmentError as e:
+            logging.warning('Could not restore locks on %s: %s', name, e)
+
+    def lock_os(self, number, offset, length):
+        """Lock a byte range against other processes."""
+        if number not in self._shares or length <= 0:
+            return
+        name = self._shares[number][0]
+        try:
+            if not self._lock_range(self._fds[name], fcntl.LOCK_EX, offset, length):
+                raise error.RunError(error.PERMISSION_DENIED)
+        except EnvironmentError as e:
+            logging.debug('Could not lock %s: %s', name, e)
+            return
+        self._ranges.setdefault(number, set()).add((offset, length))
+
+    def unlock_os(self, number, offset, length):
+        """Unlock a byte range."""
+        try:
+            self._ranges[number].remove((offset, length))
+        except KeyError:
+            return
+        name = self._shares[number][0]
+        try:
+            fcntl.lockf(self._fds[name], fcntl.LOCK_UN, length, offset)
+        except EnvironmentError as e:
+            logging.debug('Could not unlock %s: %s', name, e)
+        # restore overlapping ranges held through other files
+        self.refresh(name)
+
+    def check_os(self, number, offset, length):
+        """Raise PERMISSION DENIED if a byte range is locked by another process."""
+        if number not in self._shares:
+            return
+        name = self._shares[number][0]
+        own = [rng for num, ranges in self._ranges.iteritems()
+                if self._shares[num][0] == name for rng in ranges]
+        for start, size in own:
+            if start <= offset and offset + length <= start + size:
+                # nobody else can hold a lock here
+                return
+        fd = self._fds[name]
+        try:
+            if not self._lock_range(fd, fcntl.LOCK_SH, offset, length):
+                raise error.RunError(error.PERMISSION_DENIED)
+            fcntl.lockf(fd, fcntl.LOCK_UN, length, offset)
+        except EnvironmentError as e:
+            logging.debug('Could not test lock on %s: %s', name, e)
+        if own:
+            self.refresh(name)
+
     def release(self, number):
         """Release the lock on a file before closing."""
         try:
             del self._locks[number]
         except KeyError:
             pass
+        self._ranges.pop(number, None)
+        try:
+            name, _ = self._shares.pop(number)
+        except KeyError:
+            return
+        self.refresh(name)
 
     def open_file(self, number, f):
         """Register disk file as open."""
@@ -633,6 +860,7 @@ class BinaryFile(devices.RawFile):
         """Initialise program file object and write header."""
         devices.RawFile.__init__(self, fhandle, filetype, mode)
         self.number = number
+        self.name = name
         # don't lock binary files
         self.lock = b''
         # we need the Locks object to register file as open
@@ -691,6 +919,68 @@ class RandomFile(devices.CRLFTextFileBase):
         # position at start of file
         self.recpos = 0
         self.output_stream.seek(0)
+        # GET and PUT work on a memory map of the file if it's open for read and write
+        # the map is None while the file is empty; _pos is the position in the map
+        self._use_map = (self.output_stream.mode == b'r+b')
+        self._map, self._pos = None, 0
+        if self._use_map:
+            try:
+                self._map_file()
+            except (EnvironmentError, ValueError) as e:
+                logging.debug('Could not map random-access file %s: %s', name, e)
+                self._use_map = False
+
+    def __getstate__(self):
+        """Get pickling dict for random-access file."""
+        pickle_dict = self.__dict__.copy()
+        # mmap objects can't be pickled
+        pickle_dict['_map'] = None
+        return pickle_dict
+
+    def __setstate__(self, pickle_dict):
+        """Initialise random-access file from pickling dict."""
+        self.__dict__.update(pickle_dict)
+        if self._use_map:
+            self._map_file()
+
+    def _map_file(self):
+        """Map the file into memory, unless it's empty."""
+        self._close_map()
+        if os.fstat(self.output_stream.fileno()).st_size:
+            self._map = mmap.mmap(self.output_stream.fileno(), 0)
+
+    def _close_map(self):
+        """Close the memory map, keeping our OS locks on the file."""
+        if self._map is None:
+            return
+        self._map.close()
+        self._map = None
+        # the map holds a duplicate file descriptor; closing it drops our locks
+        if self.locks is not None:
+            self.locks.refresh(self.name)
+
+    def _map_length(self, end):
+        """Get the length of the map, remapping if it doesn't reach the given offset."""
+        if self._map is None or end > len(self._map):
+            # the file may have been extended through another stream
+            if os.fstat(self.output_stream.fileno()).st_size != (
+                    len(self._map) if self._map is not None else 0):
+                self._map_file()
+        return len(self._map) if self._map is not None else 0
+
+    def _grow_map(self, size):
+        """Grow the file and its memory map; never shrink the file."""
+        if size <= self._map_length(size):
+            return
+        if self._map is not None:
+            try:
+                self._map.resize(size)
+                return
+            except (EnvironmentError, SystemError):
+                # mremap not available on this platform
+                self._close_map()
+        self.output_stream.truncate(size)
+        self._map_file()
 
     def switch_mode(self, new_mode):
         """Switch to input or output mode"""
@@ -727,6 +1017,10 @@ class RandomFile(devices.CRLFTextFileBase):
     def close(self):
         """Close random-access file."""
         devices.CRLFTextFileBase.close(self)
+        if self._map is not None:
+            self._map.flush()
+            self._map.close()
+            self._map = None
         self.output_stream.close()
         if self.locks is not None:
             self.locks.release(self.number)
@@ -734,7 +1028,18 @@ class RandomFile(devices.CRLFTextFileBase):
 
     def get(self, dummy=None):
         """Read a record."""
-        if self.eof():
+        if self.lock_type:
+            self.locks.check_os(self.number, self.recpos*self.reclen, self.reclen)
+        if self._use_map:
+            # past end of file, as in eof()
+            if self._pos > self._map_length(self._pos + self.reclen):
+                contents = b'\0' * self.reclen
+            elif self._map is not None:
+                contents = self._map[self._pos:self._pos+self.reclen]
+                self._pos += len(contents)
+            else:
+                contents = b''
+        elif self.eof():
             contents = b'\0' * self.reclen
         else:
             contents = self.output_stream.read(self.reclen)
@@ -746,18 +1051,38 @@ class RandomFile(devices.CRLFTextFileBase):
 
     def put(self, dummy=None):
         """Write a record."""
-        current_length = self.lof()
-        if self.recpos > current_length:
-            self.output_stream.seek(0, 2)
-            numrecs = self.recpos-current_length
-            self.output_stream.write(b'\0' * numrecs * self.reclen)
-        self.output_stream.write(self.field.buffer)
+        if self.lock_type:
+            self.locks.check_os(self.number, self.recpos*self.reclen, self.reclen)
+        if self._use_map:
+            current_length = self._map_length(self._pos + self.reclen)
+            if self.recpos > current_length:
+                numrecs = self.recpos-current_length
+                self._pos = current_length
+                self._write_map(b'\0' * numrecs * self.reclen)
+            self._write_map(self.field.buffer)
+        else:
+            current_length = self.lof()
+            if self.recpos > current_length:
+                self.output_stream.seek(0, 2)
+                numrecs = self.recpos-current_length
+                self.output_stream.write(b'\0' * numrecs * self.reclen)
+            self.output_stream.write(self.field.buffer)
         self.recpos += 1
 
+    def _write_map(self, data):
+        """Write to the memory map at the current position, growing the file if needed."""
+        end = self._pos + len(data)
+        self._grow_map(end)
+        self._map[self._pos:end] = bytes(data)
+        self._pos = end
+
     def set_pos(self, newpos):
         """Set current record number."""
         # first record is newpos number 1
-        self.output_stream.seek((newpos-1)*self.reclen)
+        if self._use_map:
+            self._pos = int((newpos-1)*self.reclen)
+        else:
+            self.output_stream.seek((newpos-1)*self.reclen)
         self.recpos = newpos - 1
 
     def loc(self):
@@ -770,6 +1095,9 @@ class RandomFile(devices.CRLFTextFileBase):
 
     def lof(self):
         """Get length of file, in bytes, for LOF."""
+        if self._use_map:
+            # check the file itself, as other streams may have extended it
+            return os.fstat(self.output_stream.fileno()).st_size
         current = self.output_stream.tell()
         self.output_stream.seek(0, 2)
         lof = self.output_stream.tell()
@@ -784,6 +1112,7 @@ class RandomFile(devices.CRLFTextFileBase):
                         or (start >= start_1 and start <= stop_1)
                         or (stop >= start_1 and stop <= stop_1)):
                 raise error.RunError(error.PERMISSION_DENIED)
+        self.locks.lock_os(self.number, *self._lock_range(start, stop))
         self.lock_list.add((start, stop))
 
     def unlock(self, start, stop):
@@ -793,11 +1122,20 @@ class RandomFile(devices.CRLFTextFileBase):
             self.lock_list.remove((start, stop))
         except KeyError:
             raise error.RunError(error.PERMISSION_DENIED)
+        self.locks.unlock_os(self.number, *self._lock_range(start, stop))
+
+    def _lock_range(self, start, stop):
+        """Get the byte offset and length of a range of records."""
+        if start is None and stop is None:
+            return 0, Locks._share_base
+        return int(start-1) * self.reclen, int(stop-start+1) * self.reclen
 
 
 class TextFile(devices.CRLFTextFileBase):
     """Text file on disk device."""
 
+    read_ahead = 4096
+
     def __init__(self, fhandle, filetype, number, name,
                  mode=b'A', access=b'RW', lock=b'',
                  codepage=None, universal=False, split_long_lines=True, locks=None):
@@ -835,8 +1173,8 @@ class TextFile(devices.CRLFTextFileBase):
         """Get file pointer LOC """
         # for LOC(i)
         if self.mode == b'I':
-            return max(1, (127+self.fhandle.tell())/128)
-        return self.fhandle.tell()/128
+            return max(1, (127+self._tell())/128)
+        return self._tell()/128
 
     def lof(self):
         """Get length of file LOF."""
@@ -899,6 +1237,7 @@ class TextFile(devices.CRLFTextFileBase):
         """Lock the file."""
         if set.union(*(f.lock_list for f in self.locks.list(self.name))):
             raise error.RunError(error.PERMISSION_DENIED)
+        self.locks.lock_os(self.number, 0, Locks._share_base)
         self.lock_list.add(True)
 
     def unlock(self, start, stop):
@@ -907,3 +1246,4 @@ class TextFile(devices.CRLFTextFileBase):
             self.lock_list.remove(True)
         except KeyError:
             raise error.RunError(error.PERMISSION_DENIED)
+        self.locks.unlock_os(self.number, 0, Locks._share_base)
@@ -1093,7 +1093,7 @@ class Screen(object):
         """Write a string to the screen at the current position."""
         if do_echo:
             # CR -> CRLF, CRLF -> CRLF LF
-            self.redirect.write(''.join([ ('\r\n' if c == '\r' else c) for c in s ]))
+            self.redirect.write(bytes(s).replace('\r', '\r\n'))
         last = ''
         # if our line wrapped at the end before, it doesn't anymore
         self.apage.row[self.current_row-1].wrap = False
@@ -7,12 +7,15 @@ This file is released under the GNU GPL version 3 or later.
 """
 
 import os
+import re
+import codecs
 import subprocess
 import logging
 import threading
-import time
 import locale
 import platform
+if platform.system() != 'Windows':
+    import select
 
 try:
     import pexpect
@@ -116,15 +119,14 @@ class WindowsShell(ShellBase):
     def _process_stdout(self, stream, shell_output):
         """Retrieve SHELL output and write to console."""
         while True:
-            # blocking read
-            c = stream.read(1)
-            if c:
-                # don't access screen in this thread
-                # the other thread already does
-                shell_output.append(c)
-            else:
-                # don't hog cpu, sleep 1 ms
-                time.sleep(0.001)
+            # blocking read of whatever is available
+            chunk = os.read(stream.fileno(), 4096)
+            if not chunk:
+                # pipe closed
+                return
+            # don't access screen in this thread
+            # the other thread already does
+            shell_output.append(chunk)
 
     def launch(self, command):
         """Run a SHELL subprocess."""
@@ -141,15 +143,30 @@ class WindowsShell(ShellBase):
         errp.daemon = True
         errp.start()
         word = b''
-        while p.poll() is None or shell_output:
+        # multibyte sequences and CRLF may be split between chunks
+        decoder = codecs.getincrementaldecoder(self._encoding)(b'replace')
+        pending = u''
+        while True:
             if shell_output:
-                lines, shell_output[:] = b''.join(shell_output).split('\r\n'), []
+                # take the chunks collected so far; the readers may append more
+                num = len(shell_output)
+                pending += decoder.decode(b''.join(shell_output[:num]))
+                del shell_output[:num]
+                lines = pending.split(u'\r\n')
                 last = lines.pop()
+                if last.endswith(u'\r'):
+                    last, pending = last[:-1], u'\r'
+                else:
+                    pending = u''
                 for line in lines:
-                    self.screen.write_line(self.codepage.str_from_unicode(line.decode(self._encoding)))
-                self.screen.write(self.codepage.str_from_unicode(last.decode(self._encoding)))
+                    self.screen.write_line(self.codepage.str_from_unicode(line))
+                self.screen.write(self.codepage.str_from_unicode(last))
             if p.poll() is not None:
-                # drain output then break
+                # give the readers a moment to collect the last output, drain, then break
+                outp.join(0.1)
+                errp.join(0.1)
+                if not shell_output:
+                    break
                 continue
             try:
                 # expand=False suppresses key macros
@@ -173,11 +190,22 @@ class WindowsShell(ShellBase):
                 # needed for Wine and to handle backspace properly
                 word += c
                 self.screen.write(c)
+        # flush any multibyte sequence cut off at the end of the output
+        pending += decoder.decode(b'', final=True)
+        if pending:
+            self.screen.write(self.codepage.str_from_unicode(pending))
 
 
 class Shell(ShellBase):
     """Launcher for Unix shell."""
 
+    # size of output chunks read from the terminal
+    chunk_size = 4096
+    # maximum number of chunks written between keyboard checks
+    max_chunks = 16
+    # output characters that are handled separately
+    _control_chars = re.compile(u'([\r\n\b])')
+
     def __init__(self, keyboard, screen, codepage, shell_command):
         """Initialise the shell."""
         if not pexpect:
@@ -194,6 +222,8 @@ class Shell(ShellBase):
         if command:
             cmd += u' -c "' + self.codepage.str_to_unicode(command) + u'"'
         p = pexpect.spawn(cmd.encode(self._encoding))
+        # multibyte sequences may be split between chunks
+        decoder = codecs.getincrementaldecoder(self._encoding)(b'replace')
         while True:
             try:
                 # expand=False suppresses key macros
@@ -208,21 +238,33 @@ class Shell(ShellBase):
             elif c != b'':
                 c = self.codepage.to_unicode(c).encode(self._encoding)
                 p.send(c)
-            while True:
+            # check before reading, so that we have all output once it's dead
+            alive, drained = p.isalive(), False
+            for _ in range(self.max_chunks):
+                # don't wait for output, check the keyboard again
+                if not select.select([p.child_fd], [], [], 0)[0]:
+                    drained = True
+                    break
                 try:
-                    c = p.read_nonblocking(1, timeout=0).decode(self._encoding)
-                except:
-                    c = u''
-                if c == u'' or c == u'\n':
+                    chunk = p.read_nonblocking(self.chunk_size, timeout=0)
+                except (pexpect.EOF, pexpect.TIMEOUT):
+                    drained = True
                     break
-                elif c == u'\r':
-                    self.screen.write_line()
-                elif c == u'\b':
-                    if self.screen.current_col != 1:
-                        self.screen.set_pos(
-                                self.screen.current_row,
-                                self.screen.current_col-1)
-                else:
-                    self.screen.write(self.codepage.from_unicode(c))
-            if c == u'' and not p.isalive():
+                self._write_output(decoder.decode(chunk))
+            if drained and not alive:
+                # flush any multibyte sequence cut off at the end of the output
+                self._write_output(decoder.decode(b'', final=True))
                 return
+
+    def _write_output(self, output):
+        """Write a chunk of shell output to the screen."""
+        for part in self._control_chars.split(output):
+            if part == u'\r':
+                self.screen.write_line()
+            elif part == u'\b':
+                if self.screen.current_col != 1:
+                    self.screen.set_pos(
+                            self.screen.current_row,
+                            self.screen.current_col-1)
+            elif part and part != u'\n':
+                self.screen.write(self.codepage.str_from_unicode(part))
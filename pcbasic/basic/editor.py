@@ -6,6 +6,7 @@ Direct mode environment
 This file is released under the GNU GPL version 3 or later.
 """
 
+import re
 import string
 
 from .base import error
@@ -39,6 +40,9 @@ alt_key_replace = {
     ea.ALT_x: tk.KW_XOR,
     }
 
+# characters that the editor treats as keystrokes rather than text
+control_chars = re.compile(b'[\x00-\x1f\x7f]')
+
 
 class Editor(object):
     """Interactive environment."""
@@ -57,6 +61,10 @@ class Editor(object):
     def wait_screenline(self, write_endl=True, from_start=False):
         """Enter interactive mode and read string from console."""
         # from_start means direct entry mode, otherwise input mode
+        if not from_start:
+            line = self._wait_stream_line(write_endl)
+            if line is not None:
+                return line
         prompt_width = 0 if from_start else self.screen.current_col-1
         try:
             # give control to user for interactive mode
@@ -85,6 +93,28 @@ class Editor(object):
         # with trailing whitespace removed
         return str(outstr[:255].rstrip(' \t\n'))
 
+    def _wait_stream_line(self, write_endl):
+        """Read a line of redirected input directly, if the editor would return it unchanged."""
+        line = self.keyboard.read_stream_line()
+        if line is None:
+            return None
+        text = line[:-1] if line[-1:] == b'\r' else line
+        row, col = self.screen.current_row, self.screen.current_col
+        # the line must be plain text that fits on the prompt row without wrapping
+        if (text == line or control_chars.search(text)
+                or self.keyboard.codepage.dbcs or self.screen.overflow
+                or col + len(text) > self.screen.mode.width
+                or self.screen.apage.row[row-1].wrap
+                or (row > 1 and self.screen.apage.row[row-2].wrap)):
+            self.keyboard.unread_stream_line(line)
+            return None
+        for c in text:
+            self.screen.write_char(c)
+        self.redirect.write(text)
+        if write_endl:
+            self.screen.write_line()
+        return text[:255].rstrip(' \t\n')
+
     def find_start_of_line(self, srow):
         """Find the start of the logical line that includes our current position."""
         # move up as long as previous line wraps
@@ -463,7 +463,8 @@ class Devices(object):
 
     def __init__(self, values, memory, input_methods, fields, screen, keyboard,
                 device_params, current_device, mount_dict,
-                print_trigger, temp_dir, serial_in_size, utf8, universal):
+                print_trigger, temp_dir, serial_in_size, utf8, universal,
+                output_redirection=None):
         """Initialise devices."""
         self.devices = {}
         self._values = values
@@ -480,14 +481,14 @@ class Devices(object):
         # parallel devices - LPT1: must always be defined
         if not device_params:
             device_params = {'LPT1:': '', 'LPT2:': '', 'LPT3:': '', 'COM1:': '', 'COM2:': '', 'CAS1:': ''}
-        self.devices['LPT1:'] = ports.LPTDevice(device_params['LPT1:'], devices.nullstream(), print_trigger, self.codepage, temp_dir)
-        self.devices['LPT2:'] = ports.LPTDevice(device_params['LPT2:'], None, print_trigger, self.codepage, temp_dir)
-        self.devices['LPT3:'] = ports.LPTDevice(device_params['LPT3:'], None, print_trigger, self.codepage, temp_dir)
+        self.devices['LPT1:'] = ports.LPTDevice(device_params['LPT1:'], devices.nullstream(), print_trigger, self.codepage, temp_dir, output_redirection)
+        self.devices['LPT2:'] = ports.LPTDevice(device_params['LPT2:'], None, print_trigger, self.codepage, temp_dir, output_redirection)
+        self.devices['LPT3:'] = ports.LPTDevice(device_params['LPT3:'], None, print_trigger, self.codepage, temp_dir, output_redirection)
         self.lpt1_file = self.devices['LPT1:'].device_file
         # serial devices
         # buffer sizes (/c switch in GW-BASIC)
-        self.devices['COM1:'] = ports.COMDevice(device_params['COM1:'], input_methods, devices.Field(serial_in_size), serial_in_size)
-        self.devices['COM2:'] = ports.COMDevice(device_params['COM2:'], input_methods, devices.Field(serial_in_size), serial_in_size)
+        self.devices['COM1:'] = ports.COMDevice(device_params['COM1:'], input_methods, devices.Field(serial_in_size), serial_in_size, output_redirection)
+        self.devices['COM2:'] = ports.COMDevice(device_params['COM2:'], input_methods, devices.Field(serial_in_size), serial_in_size, output_redirection)
         # cassette
         # needs a screen for write() and write_line() to display Found and Skipped messages on opening files
         self.devices['CAS1:'] = cassette.CASDevice(device_params['CAS1:'], screen)
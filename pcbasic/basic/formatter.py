@@ -15,6 +15,11 @@ from . import values
 class Formatter(object):
     """Output string formatter."""
 
+    # maximum number of compiled PRINT USING templates to keep
+    max_templates = 64
+    # compiled PRINT USING templates by format string
+    _templates = {}
+
     def __init__(self, output, memory, screen=None):
         """Initialise."""
         self._screen = screen
@@ -83,49 +88,33 @@ class Formatter(object):
         format_expr = self._memory.strings.next_temporary(args)
         if format_expr == '':
             raise error.RunError(error.IFC)
-        fors = codestream.CodeStream(format_expr)
+        fields, trailing_literal = self._get_template(format_expr)
         newline, format_chars = True, False
-        start_cycle = True
-        initial_literal = ''
         try:
             while True:
-                c = fors.peek()
-                if c == '':
-                    if not format_chars:
-                        # avoid infinite loop
-                        break
-                    # loop the format string if more variables to come
-                    start_cycle = True
-                    initial_literal = ''
-                    fors.seek(0)
-                elif c == '_':
-                    # escape char; write next char in fors or _ if this is the last char
+                start_cycle = True
+                initial_literal = ''
+                for literal, format_field in fields:
                     if start_cycle:
-                        initial_literal += fors.read(2)[-1]
+                        initial_literal += literal
                     else:
-                        self._output.write(fors.read(2)[-1])
-                else:
+                        self._write_literal(literal)
                     with self._memory.strings:
-                        try:
-                            format_field = StringField(fors)
-                        except ValueError:
-                            try:
-                                format_field = NumberField(fors)
-                            except ValueError:
-                                if start_cycle:
-                                    initial_literal += fors.read(1)
-                                else:
-                                    self._output.write(fors.read(1))
-                                continue
                         value = next(args)
                         if value is None:
                             newline = False
-                            break
+                            raise StopIteration()
                         if start_cycle:
                             self._output.write(initial_literal)
                             start_cycle = False
                             format_chars = True
                         self._output.write(format_field.format(value))
+                if not format_chars:
+                    # avoid infinite loop
+                    initial_literal += trailing_literal
+                    break
+                # loop the format string if more variables to come
+                self._write_literal(trailing_literal)
         except StopIteration:
             pass
         if not format_chars:
@@ -134,10 +123,50 @@ class Formatter(object):
             raise error.RunError(error.IFC)
         return newline
 
+    def _write_literal(self, literal):
+        """Write literal characters from the format string one by one."""
+        for c in literal:
+            self._output.write(c)
+
+    @classmethod
+    def _get_template(cls, format_expr):
+        """Get the compiled template for a format string."""
+        try:
+            return cls._templates[format_expr]
+        except KeyError:
+            if len(cls._templates) >= cls.max_templates:
+                cls._templates.clear()
+            template = cls._templates[format_expr] = _compile_template(format_expr)
+            return template
+
 
 ##############################################################################
 # formatting functions and format string parsers
 
+def _compile_template(format_expr):
+    """Parse a PRINT USING format string into fields, each with its preceding literal, and a trailing literal."""
+    fors = codestream.CodeStream(format_expr)
+    fields, literal = [], ''
+    while True:
+        c = fors.peek()
+        if c == '':
+            break
+        elif c == '_':
+            # escape char; literal next char in fors or _ if this is the last char
+            literal += fors.read(2)[-1]
+        else:
+            try:
+                format_field = StringField(fors)
+            except ValueError:
+                try:
+                    format_field = NumberField(fors)
+                except ValueError:
+                    literal += fors.read(1)
+                    continue
+            fields.append((literal, format_field))
+            literal = ''
+    return tuple(fields), literal
+
 class StringField(object):
     """String Formatter for PRINT USING."""
 
@@ -225,54 +254,60 @@ class NumberField(object):
             word += fors.read(4)
         if not leading_plus and fors.peek() in ('-', '+'):
             word += fors.read(1)
-        self._tokens, self._digits_before, self._decimals, self._comma = word, digits_before, decimals, comma
+        self._tokens, self._decimals, self._comma = word, decimals, comma
+        # illegal function call if too many digits
+        self._too_long = digits_before + decimals > 24
+        # dollar sign, decimal point, exponent
+        self._has_dollar, self._force_dot = '$' in word, '.' in word
+        self._scientific = '^' in word
+        self._filler = '*' if '*' in word else ' '
+        # sign position
+        if word[0] == '+':
+            self._sign = 'lead'
+        elif word[-1] in ('+', '-'):
+            self._sign = word[-1]
+        else:
+            self._sign = None
+            # reserve space for sign in scientific notation by taking away a digit position
+            if not self._has_dollar:
+                digits_before = max(0, digits_before - 1)
+        self._digits_before = digits_before
 
     def format(self, value):
         """Format a number to a format string."""
         value = values.pass_number(value)
-        tokens = self._tokens
-        digits_before = self._digits_before
-        decimals = self._decimals
-        comma = self._comma
         # promote ints to single
         value = value.to_float()
-        # illegal function call if too many digits
-        if digits_before + decimals > 24:
+        if self._too_long:
             raise error.RunError(error.IFC)
-        # dollar sign, decimal point
-        has_dollar, force_dot = '$' in tokens, '.' in tokens
         # leading sign, if any
         valstr, post_sign = '', ''
         neg = value.is_negative()
-        if tokens[0] == '+':
+        if self._sign == 'lead':
             valstr += '-' if neg else '+'
-        elif tokens[-1] == '+':
+        elif self._sign == '+':
             post_sign = '-' if neg else '+'
-        elif tokens[-1] == '-':
+        elif self._sign == '-':
             post_sign = '-' if neg else ' '
-        else:
-            valstr += '-' if neg else ''
-            # reserve space for sign in scientific notation by taking away a digit position
-            if not has_dollar:
-                digits_before -= 1
-                if digits_before < 0:
-                    digits_before = 0
+        elif neg:
+            valstr += '-'
         # take absolute value
         # NOTE: this could overflow for Integer -32768
         # but we convert to Float before calling format_number
         value = value.clone().iabs()
         # currency sign, if any
-        valstr += '$' if has_dollar else ''
+        if self._has_dollar:
+            valstr += '$'
         # format to string
-        if '^' in tokens:
-            valstr += value.to_str_scientific(digits_before, decimals, force_dot, comma)
+        if self._scientific:
+            valstr += value.to_str_scientific(self._digits_before, self._decimals, self._force_dot, self._comma)
         else:
-            valstr += value.to_str_fixed(decimals, force_dot, comma)
+            valstr += value.to_str_fixed(self._decimals, self._force_dot, self._comma)
         # trailing signs, if any
         valstr += post_sign
-        if len(valstr) > len(tokens):
+        if len(valstr) > len(self._tokens):
             valstr = '%' + valstr
         else:
             # filler
-            valstr = valstr.rjust(len(tokens), '*' if '*' in tokens else ' ')
+            valstr = valstr.rjust(len(self._tokens), self._filler)
         return valstr
@@ -10,6 +10,7 @@ import datetime
 import logging
 import time
 import Queue
+from collections import deque
 
 from .base import error
 from .base import scancode
@@ -70,10 +71,12 @@ home_key_replacements_eascii = {
 class InputMethods(object):
     """Manage input queue."""
 
-    def __init__(self, queues, values):
+    def __init__(self, queues, values, output_redirection):
         """Initialise event triggers."""
         self._values = values
         self._queues = queues
+        # redirected output is flushed while we wait for input
+        self._redirect = output_redirection
 
     def init(self, screen, codepage, keystring, ignore_caps, ctrl_c_is_break):
         """Finish initialisation."""
@@ -96,6 +99,7 @@ class InputMethods(object):
 
     def wait(self):
         """Wait and check events."""
+        self._redirect.flush()
         time.sleep(self.tick)
         self.check_events()
 
@@ -138,7 +142,7 @@ class InputMethods(object):
             elif signal.event_type == signals.KEYB_UP:
                 self.keyboard.key_up(*signal.params)
             elif signal.event_type == signals.STREAM_CHAR:
-                self.keyboard.insert_chars(*signal.params, check_full=False)
+                self.keyboard.insert_stream(*signal.params)
             elif signal.event_type == signals.STREAM_CLOSED:
                 self.keyboard.close_input()
             elif signal.event_type == signals.PEN_DOWN:
@@ -328,6 +332,10 @@ class Keyboard(object):
         self.buf.insert(self.codepage.str_from_unicode(keystring), check_full=False)
         # redirected input stream has closed
         self._input_closed = False
+        # take redirected input as lines rather than keystrokes
+        self.direct_stream = False
+        # lines of redirected input not yet fed into the keyboard buffer
+        self._stream = deque()
         # input_methods is needed for wait() in wait_char()
         self.input_methods = input_methods
 
@@ -352,6 +360,7 @@ class Keyboard(object):
         """Read any keystroke, nonblocking."""
         # wait a tick to reduce CPU load in loops
         self.input_methods.wait()
+        self._feed_stream()
         return self.buf.getc(expand)
 
     def inkey_(self, args):
@@ -362,8 +371,10 @@ class Keyboard(object):
 
     def wait_char(self):
         """Wait for character, then return it but don't drop from queue."""
+        self._feed_stream()
         while self.buf.is_empty() and not self._input_closed:
             self.input_methods.wait()
+            self._feed_stream()
         return self.buf.peek()
 
     def get_char_block(self):
@@ -376,6 +387,33 @@ class Keyboard(object):
         self.pause = False
         self.buf.insert(self.codepage.str_from_unicode(us), check_full)
 
+    def insert_stream(self, us):
+        """Insert a line of redirected input."""
+        if self.direct_stream:
+            self._stream.append(self.codepage.str_from_unicode(us))
+        else:
+            self.insert_chars(us, check_full=False)
+
+    def _feed_stream(self):
+        """Type the next line of redirected input if the keyboard buffer is empty."""
+        if self._stream and self.buf.is_empty():
+            self.buf.insert(self._stream.popleft(), check_full=False)
+
+    def read_stream_line(self):
+        """Wait for a line of redirected input, bypassing the keyboard buffer."""
+        # keystrokes waiting in the buffer need to go through the editor first
+        while self.direct_stream and self.buf.is_empty():
+            if self._stream:
+                return self._stream.popleft()
+            elif self._input_closed:
+                break
+            self.input_methods.wait()
+        return None
+
+    def unread_stream_line(self, line):
+        """Type a line of redirected input that could not be used directly."""
+        self.buf.insert(line, check_full=False)
+
     def key_down(self, c, scan, mods, check_full=True):
         """Insert a key-down event by eascii/unicode, scancode and modifiers."""
         # emulator home-key (f12) replacements
@@ -383,9 +383,14 @@ class Interpreter(object):
         self._scalars.set(varname, start)
         # obtain a view of the loop variable
         counter_view = self._scalars.view(varname)
-        self.for_stack.append((varname, counter_view, stop, step, step.sign(), forpos, nextpos,))
+        sgn = step.sign()
+        empty = start.gt(stop) if sgn > 0 else stop.gt(start)
+        if vartype == values.INT:
+            # integer loops are iterated on Python ints, see iterate_loop
+            stop, step = stop.to_int(), step.to_int()
+        self.for_stack.append((varname, counter_view, stop, step, sgn, forpos, nextpos,))
         # empty loop: jump to NEXT without executing block
-        if (start.gt(stop) if step.sign() > 0 else stop.gt(start)):
+        if empty:
             ins.seek(nextpos)
             self.iterate_loop()
 
@@ -438,10 +443,20 @@ class Interpreter(object):
                 break
         else:
             raise error.RunError(error.NEXT_WITHOUT_FOR)
-        # increment counter
-        counter_view.iadd(step)
-        # check condition
-        loop_ends = counter_view.gt(stop) if sgn > 0 else stop.gt(counter_view)
+        if varname2[-1] == values.INT:
+            # increment counter in the variable's buffer, so that it can be observed
+            buf = counter_view.view()
+            counter = struct.unpack('<h', buf)[0] + step
+            if not -0x8000 <= counter <= 0x7fff:
+                raise error.RunError(error.OVERFLOW)
+            struct.pack_into('<h', buf, 0, counter)
+            # check condition
+            loop_ends = counter > stop if sgn > 0 else stop > counter
+        else:
+            # increment counter
+            counter_view.iadd(step)
+            # check condition
+            loop_ends = counter_view.gt(stop) if sgn > 0 else stop.gt(counter_view)
         if loop_ends:
             self.for_stack.pop()
         else:
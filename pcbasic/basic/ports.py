@@ -16,17 +16,28 @@ import socket
 import datetime
 import platform
 import io
+import re
+import threading
+import time
+import select
 
 # kbhit() also appears in video_none.py
 if platform.system() == 'Windows':
     from msvcrt import kbhit
 else:
-    import select
-
     def kbhit():
         """Return whether a character is ready to be read from the keyboard."""
         return select.select([sys.stdin], [], [], 0)[0] != []
 
+def wait_readable(fileobj, timeout):
+    """Wait until a file or socket has data to read; return False on timeout."""
+    try:
+        return select.select([fileobj], [], [], timeout)[0] != []
+    except (TypeError, ValueError, EnvironmentError):
+        # can't select on this stream (e.g. Windows console); just wait and try
+        time.sleep(timeout)
+        return True
+
 try:
     import serial
     from serial import SerialException, serialutil
@@ -52,7 +63,7 @@ class COMDevice(devices.Device):
 
     allowed_modes = 'IOAR'
 
-    def __init__(self, arg, input_methods, field, serial_in_size):
+    def __init__(self, arg, input_methods, field, serial_in_size, output_redirection=None):
         """Initialise COMn: device."""
         devices.Device.__init__(self)
         addr, val = devices.parse_protocol_string(arg)
@@ -60,6 +71,8 @@ class COMDevice(devices.Device):
         self.input_methods = input_methods
         self.field = field
         self.serial_in_size = serial_in_size
+        # file currently open on this port, for ON COM
+        self._open_file = None
         try:
             if not addr and not val:
                 pass
@@ -67,7 +80,7 @@ class COMDevice(devices.Device):
                 self.stream = SocketSerialStream(val, self.input_methods, do_open=False)
             elif addr == 'STDIO' or (not addr and val.upper() == 'STDIO'):
                 crlf = (val.upper() == 'CRLF')
-                self.stream = StdIOStream(crlf)
+                self.stream = StdIOStream(crlf, output_redirection)
             elif addr == 'PORT':
                 # port can be e.g. /dev/ttyS1 on Linux or COM1 on Windows.
                 self.stream = SerialStream(val, self.input_methods, do_open=False)
@@ -105,12 +118,21 @@ class COMDevice(devices.Device):
         except Exception:
             self.stream.close()
             raise
-        f = COMFile(self.stream, self.field, self.input_methods, lf, self.serial_in_size)
+        f = COMFile(self.stream, self.field, self.input_methods, lf, self.serial_in_size, self)
         # inherit width settings from device file
         f.width = self.device_file.width
         f.col = self.device_file.col
+        # only take input from the port if the file can read it
+        if mode in ('I', 'R'):
+            f.start_reader()
+        self._open_file = f
         return f
 
+    def close_file(self, f):
+        """Deregister a file closed on this port."""
+        if self._open_file is f:
+            self._open_file = None
+
     def get_params(self, param):
         """Parse serial port connection parameters """
         max_param = 10
@@ -179,15 +201,19 @@ class COMDevice(devices.Device):
 
     def char_waiting(self):
         """Whether a char is present in buffer. For ON COM(n)."""
-        if not self.device_file:
+        # the buffer is filled by the reader thread, no need to poll the port
+        if not self._open_file:
             return False
-        return self.device_file.in_buffer != ''
+        return len(self._open_file.in_buffer) > 0
 
 
 class COMFile(devices.CRLFTextFileBase):
     """COMn: device - serial port."""
 
-    def __init__(self, fhandle, field, input_methods, linefeed, serial_in_size):
+    # seconds the reader thread waits for input before checking if it should stop
+    _read_timeout = 0.1
+
+    def __init__(self, fhandle, field, input_methods, linefeed, serial_in_size, device=None):
         """Initialise COMn: file."""
         # note that for random files, fhandle must be a seekable stream.
         devices.CRLFTextFileBase.__init__(self, fhandle, 'D', 'R')
@@ -199,9 +225,82 @@ class COMFile(devices.CRLFTextFileBase):
         self.in_buffer = bytearray()
         self.linefeed = linefeed
         self.overflow = False
+        # device to notify on close
+        self._device = device
+        # reader thread, if running
+        self._reader = None
+        self._reading = False
+        self._read_error = None
+
+    def __getstate__(self):
+        """Get pickling dict for port file."""
+        pickle_dict = self.__dict__.copy()
+        # threads can't be pickled
+        pickle_dict['_reader'] = None
+        return pickle_dict
+
+    def __setstate__(self, pickle_dict):
+        """Initialise port file from pickling dict."""
+        self.__dict__.update(pickle_dict)
+        if self._reading:
+            self.start_reader()
+
+    def start_reader(self):
+        """Start a thread filling the input buffer from the port."""
+        self._reading = True
+        self._reader = threading.Thread(target=self._read_port)
+        self._reader.daemon = True
+        self._reader.start()
+
+    def _read_port(self):
+        """Fill buffer from the port until closed; runs on the reader thread."""
+        # the reader thread only appends to the buffer and the interpreter
+        # only deletes from its start; each of these is atomic
+        while self._reading:
+            try:
+                if not self.fhandle.wait_read(self._read_timeout):
+                    continue
+                data = self.fhandle.read(self.serial_in_size)
+            except (EnvironmentError, ValueError) as e:
+                self._read_error = e
+                return
+            if not data:
+                # readable but empty means end of stream; don't spin on it
+                time.sleep(self._read_timeout)
+                continue
+            room = self.serial_in_size - len(self.in_buffer)
+            if len(data) > room:
+                # drop chars that don't fit in buffer and signal an overflow
+                self.overflow = True
+                data = data[:room]
+            self.in_buffer += data
+
+    def close(self):
+        """Stop the reader thread and close the port."""
+        self._reading = False
+        if self._reader:
+            self._reader.join()
+            self._reader = None
+        del self.in_buffer[:]
+        devices.CRLFTextFileBase.close(self)
+        if self._device:
+            self._device.close_file(self)
 
     def _check_read(self, allow_overflow=False):
         """Fill buffer at most up to buffer size; non blocking."""
+        if self._reading:
+            # buffer is filled by the reader thread
+            if self._read_error:
+                raise error.RunError(error.DEVICE_IO_ERROR)
+        else:
+            self._poll_port()
+        if not allow_overflow and self.overflow:
+            # only raise this the first time the overflow is encountered
+            self.overflow = False
+            raise error.RunError(error.COMMUNICATION_BUFFER_OVERFLOW)
+
+    def _poll_port(self):
+        """Read from the port up to buffer size."""
         try:
             self.in_buffer += self.fhandle.read(self.serial_in_size - len(self.in_buffer))
         except (EnvironmentError, ValueError):
@@ -212,18 +311,14 @@ class COMFile(devices.CRLFTextFileBase):
             # drop waiting chars that don't fit in buffer
             while self.fhandle.read(1):
                 pass
-        if not allow_overflow and self.overflow:
-            # only raise this the first time the overflow is encountered
-            self.overflow = False
-            raise error.RunError(error.COMMUNICATION_BUFFER_OVERFLOW)
 
     def read_raw(self, num=-1):
         """Read num characters from the port as a string; blocking """
         if num == -1:
             # read whole buffer, non-blocking
             self._check_read()
-            out = self.in_buffer
-            del self.in_buffer[:]
+            out = str(self.in_buffer)
+            del self.in_buffer[:len(out)]
         else:
             out = ''
             while len(out) < num:
@@ -294,10 +389,12 @@ class COMFile(devices.CRLFTextFileBase):
 class StdIOStream(object):
     """Wrapper object to route port to stdio."""
 
-    def __init__(self, crlf=False):
+    def __init__(self, crlf=False, output_redirection=None):
         """Initialise the stream."""
         self.is_open = False
         self._crlf = crlf
+        # screen output echoed to stdout, to be written out before ours
+        self._output_redirection = output_redirection
 
     def open(self, rs=False, cs=1000, ds=1000, cd=0):
         """Open a connection."""
@@ -312,13 +409,23 @@ class StdIOStream(object):
         s = ''
         while kbhit() and len(s) < num:
             c = sys.stdin.read(1)
+            if not c:
+                # end of input
+                break
             if self._crlf and c == '\n':
                 c = '\r'
             s += c
         return s
 
+    def wait_read(self, timeout):
+        """Wait until input is available on stdin; False on timeout."""
+        return wait_readable(sys.stdin, timeout)
+
     def write(self, s):
         """Write to stdout."""
+        # don't overtake screen output still held in the redirection buffer
+        if self._output_redirection:
+            self._output_redirection.flush()
         for c in s:
             if self._crlf and c == '\r':
                 c = '\n'
@@ -467,6 +574,11 @@ class SerialStream(object):
         # but that's ill-defined for ports
         return self._serial.read(num)
 
+    def wait_read(self, timeout):
+        """Wait until input is available on the port; False on timeout."""
+        self._check_open()
+        return wait_readable(self._serial, timeout)
+
     def write(self, s):
         """Write to socket."""
         self._check_open()
@@ -510,6 +622,12 @@ class SocketSerialStream(SerialStream):
                 return ''
             raise SerialException('connection failed (%s)' % e)
 
+    def wait_read(self, timeout):
+        """Wait until input is available on the socket; False on timeout."""
+        if not self._serial._isOpen:
+            raise serialutil.portNotOpenError
+        return wait_readable(self._serial._socket, timeout)
+
 
 
 ###############################################################################
@@ -523,7 +641,8 @@ class LPTDevice(devices.Device):
     # in GW-BASIC, FIELD gives a FIELD OVERFLOW; we get BAD FILE MODE.
     allowed_modes = 'OR'
 
-    def __init__(self, arg, default_stream, flush_trigger, codepage, temp_dir):
+    def __init__(self, arg, default_stream, flush_trigger, codepage, temp_dir,
+                output_redirection=None):
         """Initialise LPTn: device."""
         devices.Device.__init__(self)
         addr, val = devices.parse_protocol_string(arg)
@@ -541,7 +660,7 @@ class LPTDevice(devices.Device):
                 logging.warning('Could not attach parallel port %s to LPT device: %s', val, str(e))
         elif addr == 'STDIO' or (not addr and val == 'STDIO'):
             crlf = (val.upper() == 'CRLF')
-            self.stream = StdIOStream(crlf)
+            self.stream = StdIOStream(crlf, output_redirection)
         elif addr == 'PRINTER' or (val and not addr):
             # 'PRINTER' is default
             self.stream = printer.get_printer_stream(val, codepage, temp_dir)
@@ -584,30 +703,75 @@ class LPTFile(devices.TextFileBase):
 
     def write(self, s, can_break=True):
         """Write a string to the printer buffer."""
-        for c in str(s):
-            if can_break and self.col >= self.width and self.width != 255:  # width 255 means wrapping enabled
+        s = str(s)
+        # width 255 means wrapping enabled
+        wrap = can_break and self.width != 255
+        # buffer is flushed to the stream once up to the last line break,
+        # unless the trigger asks for more
+        flush_pos = 0
+        pos = 0
+        while pos < len(s):
+            if wrap and self.col >= self.width:
                 self.fhandle.write('\r\n')
-                self.flush()
+                flush_pos = self.fhandle.tell()
                 self.col = 1
+            c = s[pos]
             if c in ('\n', '\r', '\f'):
                 # don't replace CR or LF with CRLF when writing to files
                 self.fhandle.write(c)
-                self.flush()
                 self.col = 1
                 # do the actual printing if we're on a short trigger
                 if (self.flush_trigger == 'line' and c == '\n') or (self.flush_trigger == 'page' and c == '\f'):
+                    self.flush()
                     self.output_stream.flush()
+                flush_pos = self.fhandle.tell()
+                pos += 1
             elif c == '\b':   # BACKSPACE
                 if self.col > 1:
                     self.col -= 1
                     self.fhandle.seek(-1, 1)
                     self.fhandle.truncate()
+                pos += 1
             else:
-                self.fhandle.write(c)
+                # write up to the next control character or line wrap in one go
+                match = self._control_chars.search(s, pos)
+                end = match.start() if match else len(s)
+                if wrap:
+                    end = self._find_wrap(s, pos, end)
+                run = s[pos:end]
+                self.fhandle.write(run)
                 # nonprinting characters including tabs are not counted for WIDTH
                 # for lpt1 and files , nonprinting chars are not counted in LPOS; but chr$(8) will take a byte out of the buffer
-                if ord(c) >= 32:
-                    self.col += 1
+                self.col += devices.printing_width(run)
+                pos = end
+        if flush_pos:
+            self._flush_to(flush_pos)
+
+    def _flush_to(self, pos):
+        """Flush the printer buffer up to pos, keeping the rest."""
+        val = self.fhandle.getvalue()
+        self.output_stream.write(val[:pos])
+        self.fhandle.seek(0)
+        self.fhandle.truncate()
+        self.fhandle.write(val[pos:])
+
+    # characters that are handled individually by write()
+    _control_chars = re.compile('[\n\r\f\b]')
+
+    def _find_wrap(self, s, start, end):
+        """Find the end of the part of s[start:end] that fits before the line wraps."""
+        if self.col >= self.width:
+            # narrow width: one character is written after each wrap
+            return start + 1
+        room = self.width - self.col
+        if devices.printing_width(s[start:end]) < room:
+            return end
+        for pos in xrange(start, end):
+            if s[pos] >= ' ':
+                room -= 1
+                if not room:
+                    return pos + 1
+        return end
 
     def write_line(self, s=''):
         """Write string or bytearray and newline to file."""
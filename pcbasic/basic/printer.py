@@ -11,6 +11,8 @@ import logging
 import platform
 import os
 import io
+import threading
+from Queue import Queue
 
 if platform.system() == 'Windows':
     try:
@@ -18,6 +20,7 @@ if platform.system() == 'Windows':
         import win32com
         import win32com.shell.shell
         import win32event
+        import pythoncom
     except ImportError:
         win32print = None
 
@@ -29,23 +32,54 @@ class PrinterStreamBase(io.BytesIO):
         self.printer_name = printer_name
         self.codepage = codepage
         io.BytesIO.__init__(self)
+        # print job queue and spooler thread, started on first use
+        self._jobs, self._spooler = None, None
+
+    def __getstate__(self):
+        """Get pickling state for printer stream."""
+        value, pos, pickle_dict = io.BytesIO.__getstate__(self)
+        pickle_dict = dict(pickle_dict)
+        # threads and queues can't be pickled; spooler will be restarted on use
+        pickle_dict['_jobs'], pickle_dict['_spooler'] = None, None
+        return value, pos, pickle_dict
 
     def close(self):
         """Close the printer stream."""
         self.flush()
+        if self._spooler:
+            # wait for queued jobs to be sent
+            self._jobs.join()
         self._wait()
 
     def flush(self):
-        """Flush the printer buffer to a printer."""
+        """Send the printer buffer to the spooler."""
         printbuf = self.getvalue()
         if not printbuf:
             return
         self.seek(0)
         self.truncate()
-        # any naked lead bytes in DBCS will remain just that - avoid in-line flushes.
-        utf8buf = self.codepage.str_to_unicode(
-                    printbuf, preserve_control=True).encode('utf-8', 'replace')
-        self._line_print(utf8buf)
+        if not self._spooler:
+            self._jobs = Queue()
+            self._spooler = threading.Thread(target=self._spool)
+            self._spooler.daemon = True
+            self._spooler.start()
+        self._jobs.put(printbuf)
+
+    def _spool(self):
+        """Convert and print queued buffers; runs on the spooler thread."""
+        self._init_thread()
+        while True:
+            # each flush is a separate job, as the print trigger asked for it
+            printbuf = self._jobs.get()
+            try:
+                # any naked lead bytes in DBCS will remain just that - avoid in-line flushes.
+                utf8buf = self.codepage.str_to_unicode(
+                        printbuf, preserve_control=True).encode('utf-8', 'replace')
+                self._line_print(utf8buf)
+            except Exception as e:
+                logging.warning('Error while printing: %s', e)
+            finally:
+                self._jobs.task_done()
 
     def set_control(self, select=False, init=False, lf=False, strobe=False):
         """Set the values of the control pins."""
@@ -54,6 +88,9 @@ class PrinterStreamBase(io.BytesIO):
         """Get the values of the status pins."""
         return False, False, False, False, False
 
+    def _init_thread(self):
+        """Prepare the spooler thread for printing (dummy)."""
+
     def _line_print(self, printbuf):
         """Don't print anything."""
 
@@ -86,6 +123,10 @@ class WindowsPrinterStream(PrinterStreamBase):
         # handle for last printing process
         self.handle = -1
 
+    def _init_thread(self):
+        """Initialise COM on the spooler thread, for ShellExecuteEx."""
+        pythoncom.CoInitialize()
+
     def _line_print(self, printbuf):
         """Print the buffer to a Windows printer."""
         if self.printer_name == '' or self.printer_name == 'default':
@@ -6,6 +6,9 @@ Program buffer utilities
 This file is released under the GNU GPL version 3 or later.
 """
 
+import os
+import stat
+import time
 import logging
 import struct
 import io
@@ -18,11 +21,19 @@ from . import converter
 class Program(object):
     """BASIC program."""
 
+    # maximum number of loaded programs kept in the cache
+    max_cached = 32
+    # files changed less than this many seconds ago are not cached
+    # as a further change may fall within the file system's mtime resolution
+    settle_time = 3.
+
     def __init__(self, tokeniser, lister, max_list_line,
                 allow_protect, allow_code_poke, address, bytecode):
         """Initialise program."""
         # program bytecode buffer
         self.bytecode = bytecode
+        # loaded program images by file name
+        self._cache = {}
         self.erase()
         self.max_list_line = max_list_line
         self.allow_protect = allow_protect
@@ -33,6 +44,12 @@ class Program(object):
         self.tokeniser = tokeniser
         self.lister = lister
 
+    def __getstate__(self):
+        """Pickle the program, without the load cache."""
+        pickle_dict = self.__dict__.copy()
+        pickle_dict['_cache'] = {}
+        return pickle_dict
+
     def size(self):
         """Size of code space """
         return self.code_size
@@ -281,6 +298,9 @@ class Program(object):
 
     def load(self, g, rebuild_dict=True):
         """Load program from ascii, bytecode or protected stream."""
+        key, stamp = self._get_cache_key(g) if rebuild_dict else (None, None)
+        if key and self._load_cached(key, stamp):
+            return
         self.erase()
         if g.filetype == 'B':
             # bytecode file
@@ -297,25 +317,115 @@ class Program(object):
             self.merge(g)
         else:
             logging.debug("Incorrect file type '%s' on LOAD", g.filetype)
+        # anything loaded beyond the end of the program is kept, but ignored
+        loaded_size = self.bytecode.tell()
         # rebuild line number dict and offsets
         if rebuild_dict and g.filetype != 'A':
             self.rebuild_line_dict()
         self.code_size = self.bytecode.tell()
+        if key:
+            self._store_cached(key, stamp, max(loaded_size, self.code_size))
+
+    def _get_cache_key(self, g):
+        """Get cache key and validation stamp for a program file on disk."""
+        try:
+            st = os.fstat(g.fhandle.fileno())
+            name = g.name
+        except (AttributeError, EnvironmentError, ValueError):
+            return None, None
+        # only cache regular files that have not recently changed
+        if not stat.S_ISREG(st.st_mode) or time.time() - st.st_mtime <= self.settle_time:
+            return None, None
+        return (name, g.filetype), (st.st_ino, st.st_size, st.st_mtime)
+
+    def _load_cached(self, key, stamp):
+        """Load program from the cache, if we have a valid entry."""
+        try:
+            entry_stamp, image, code_size, line_numbers, protected, last_stored = self._cache[key]
+        except KeyError:
+            return False
+        if entry_stamp != stamp:
+            del self._cache[key]
+            return False
+        self.erase()
+        self.bytecode.seek(0)
+        self.bytecode.write(image)
+        self.bytecode.seek(code_size)
+        self.code_size = code_size
+        self.line_numbers = dict(line_numbers)
+        self.protected = protected
+        self.last_stored = last_stored
+        return True
+
+    def _store_cached(self, key, stamp, size):
+        """Keep a copy of the loaded program."""
+        if len(self._cache) >= self.max_cached:
+            self._cache.clear()
+        self._cache[key] = (
+                stamp, self.bytecode.getvalue()[:size], self.code_size,
+                dict(self.line_numbers), self.protected, self.last_stored)
 
     def merge(self, g):
         """Merge program from ascii or utf8 (if utf8_files is True) stream."""
-        while True:
-            line = g.read_line()
-            if line is None:
-                break
-            linebuf = self.tokeniser.tokenise_line(line)
-            if linebuf.read(1) == '\0':
-                # line starts with a number, add to program memory; store_line seeks to 1 first
-                self.store_line(linebuf)
-            else:
-                # we have read the :
-                if linebuf.skip_blank() not in tk.END_LINE:
-                    raise error.RunError(error.DIRECT_STATEMENT_IN_FILE)
+        # lines that follow the end of the program in ascending order are stored in one go
+        pending = []
+        last = self._last_line_number()
+        try:
+            while True:
+                line = g.read_line()
+                if line is None:
+                    break
+                linebuf = self.tokeniser.tokenise_line(line)
+                if linebuf.read(1) == '\0':
+                    # line starts with a number, add to program memory
+                    scanline = self.lister.detokenise_line_number(linebuf)
+                    empty = (linebuf.skip_blank_read() in tk.END_LINE)
+                    if not self.protected and not empty and scanline > last:
+                        pending.append((scanline, linebuf))
+                        last = scanline
+                    else:
+                        # out of order or deleting a line: store_line seeks to 1 first
+                        self._append_lines(pending)
+                        pending = []
+                        self.store_line(linebuf)
+                        last = self._last_line_number()
+                else:
+                    # we have read the :
+                    if linebuf.skip_blank() not in tk.END_LINE:
+                        raise error.RunError(error.DIRECT_STATEMENT_IN_FILE)
+        finally:
+            # keep the lines read so far, also on error
+            self._append_lines(pending)
+
+    def _last_line_number(self):
+        """Get the highest line number in the program, or -1 if empty."""
+        numbers = [num for num in self.line_numbers if num != 65536]
+        return max(numbers) if numbers else -1
+
+    def _append_lines(self, lines):
+        """Store line buffers in ascending order after the end of the program."""
+        if not lines:
+            return
+        pos = self.line_numbers[65536]
+        # read the end-of-program marker and anything beyond
+        self.bytecode.seek(pos)
+        rest = self.bytecode.read()
+        self.bytecode.seek(pos)
+        chunks = []
+        for scanline, linebuf in lines:
+            # set offsets
+            linebuf.seek(3) # pass \x00\xC0\xDE
+            length = len(linebuf.getvalue())
+            chunks.append(struct.pack('<BH', 0, self.code_start + 1 + pos + length))
+            chunks.append(linebuf.read())
+            self.line_numbers[scanline] = pos
+            pos += length
+        self.bytecode.write(b''.join(chunks))
+        self.truncate(rest)
+        # leave the pointer past the end-of-program marker, as update_line_dict does
+        self.bytecode.seek(pos + 3)
+        self.line_numbers[65536] = pos
+        self.last_stored = scanline
 
     def save(self, g):
         """Save the program to stream g in (A)scii, (B)ytecode or (P)rotected mode."""
@@ -333,15 +443,16 @@ class Program(object):
             converter.protect(self.bytecode, g)
         else:
             # ascii mode
+            code, pos = self.bytecode.getvalue(), 1
             while True:
-                current_line, output, _ = self.lister.detokenise_line(self.bytecode)
+                current_line, output, _, pos = self.lister.detokenise_line_at(code, pos)
                 if current_line == -1 or (current_line > self.max_list_line):
                     break
                 g.write_line(str(output))
         self.bytecode.seek(current)
 
     def list_lines(self, from_line, to_line):
-        """List line range."""
+        """List line range; return a generator of lines."""
         from_line, to_line = self.explicit_lines(from_line, to_line)
         if self.protected:
             # don't list protected files
@@ -357,12 +468,7 @@ class Program(object):
         listable = sorted([self.line_numbers[num] for num in numbers])
         if numbers:
             self.last_stored = max(numbers)
-        lines = []
-        for pos in listable:
-            self.bytecode.seek(pos + 1)
-            _, line, _ = self.lister.detokenise_line(self.bytecode)
-            lines.append(str(line))
-        return lines
+        return self.lister.detokenise_lines(self.bytecode.getvalue(), (pos + 1 for pos in listable))
 
     def get_memory(self, offset):
         """Retrieve data from program code."""
@@ -24,7 +24,10 @@ def get_redirection(codepage, stdio, input_file, output_file, append, queue):
         stdin_stream = sys.stdin
     else:
         stdout_stream, stdin_stream = None, None
-    output_redirection = OutputRedirection(output_file, append, stdout_stream)
+    # flush every line to a terminal, otherwise only when the buffer fills up
+    flush_on_newline = stdio and sys.stdout.isatty()
+    output_redirection = OutputRedirection(
+            output_file, append, stdout_stream, flush_on_newline)
     input_stream = None
     if input_file:
         try:
@@ -41,28 +44,65 @@ def get_redirection(codepage, stdio, input_file, output_file, append, queue):
 class OutputRedirection(object):
     """Manage I/O redirection."""
 
-    def __init__(self, option_output, append, filter_stream):
+    def __init__(self, option_output, append, filter_stream,
+                flush_on_newline=False, buffer_size=8192):
         """Initialise redirects."""
         # redirect output to file or printer
         self._output_echos = []
+        # streams opened for redirection, flushed when output is flushed
+        self._streams = []
         # filter interface depends on redirection output
         if filter_stream:
-            self._output_echos.append(filter_stream)
+            self._streams.append(filter_stream)
         if option_output:
             mode = b'ab' if append else b'wb'
             try:
                 # raw codepage output to file
-                self._output_echos.append(open(option_output, mode))
+                self._streams.append(open(option_output, mode))
             except EnvironmentError as e:
                 logging.warning(u'Could not open output file %s: %s', option_output, e.strerror)
+        self._output_echos.extend(self._streams)
+        # output buffer and flush policy
+        self._buffer = []
+        self._buffer_length = 0
+        self.flush_on_newline = flush_on_newline
+        self.buffer_size = buffer_size
+
+    def __getstate__(self):
+        """Pickler."""
+        # don't lose buffered output
+        self.flush()
+        return self.__dict__
 
     def write(self, s):
         """Write a string/bytearray to all redirected outputs."""
-        for f in self._output_echos:
-            f.write(s)
+        if not self._output_echos:
+            return
+        s = bytes(s)
+        self._buffer.append(s)
+        self._buffer_length += len(s)
+        if (self._buffer_length >= self.buffer_size
+                or (self.flush_on_newline and b'\n' in s)):
+            self._write_buffer()
+
+    def _write_buffer(self):
+        """Write out the buffered output in one go."""
+        if self._buffer:
+            s = b''.join(self._buffer)
+            self._buffer, self._buffer_length = [], 0
+            for f in self._output_echos:
+                f.write(s)
+
+    def flush(self):
+        """Write out buffered output, e.g. before waiting for input or on exit."""
+        self._write_buffer()
+        for f in self._streams:
+            f.flush()
 
     def toggle_echo(self, stream):
         """Toggle copying of all screen I/O to stream."""
+        # buffered output goes to the echos in place when it was written
+        self._write_buffer()
         if stream in self._output_echos:
             self._output_echos.remove(stream)
         else:
@@ -113,7 +113,8 @@ class Session(object):
         self.input_redirection, self.output_redirection = redirect.get_redirection(
                 self.codepage, stdio, input_file, output_file, append, self.queues.inputs)
         # prepare input methods
-        self.input_methods = inputmethods.InputMethods(self.queues, self.values)
+        self.input_methods = inputmethods.InputMethods(
+                self.queues, self.values, self.output_redirection)
         # initialise sound queue
         self.sound = sound.Sound(self.queues, self.values, self.input_methods, syntax)
         # Sound is needed for the beeps on \a
@@ -126,6 +127,8 @@ class Session(object):
         # initialise input methods
         # screen is needed for print_screen, clipboard copy and pen poll
         self.input_methods.init(self.screen, self.codepage, keystring, ignore_caps, ctrl_c_is_break)
+        # without an interface, INPUT can take redirected lines without keyboard emulation
+        self.input_methods.keyboard.direct_stream = not iface
         # initilise floating-point error message stream
         self.values.set_screen(self.screen)
         ######################################################################
@@ -134,12 +137,13 @@ class Session(object):
         # intialise devices and files
         # DataSegment needed for COMn and disk FIELD buffers
         # InputMethods needed for wait()
+        # OutputRedirection needed to keep STDIO ports behind the screen echo
         self.devices = files.Devices(
                 self.values, self.memory, self.input_methods, self.memory.fields,
                 self.screen, self.input_methods.keyboard,
                 device_params, current_device, mount_dict,
                 print_trigger, temp_dir, serial_buffer_size,
-                utf8, universal)
+                utf8, universal, self.output_redirection)
         self.files = files.Files(self.values, self.devices, self.memory, max_files, max_reclen)
         # set LPT1 as target for print_screen()
         self.screen.set_print_screen_target(self.devices.lpt1_file)
@@ -224,6 +228,7 @@ class Session(object):
             # use dummy video & audio queues if not provided
             # but an input queue shouls be operational for redirects
             self.queues.set(inputs=Queue.Queue())
+        self.input_methods.keyboard.direct_stream = not iface
         # attach input queue to redirects
         self.input_redirection.attach(self.queues.inputs)
         return self
@@ -242,24 +247,27 @@ class Session(object):
 
     def execute(self, command):
         """Execute a BASIC statement."""
+        self.compile_statement(command).execute()
+
+    def evaluate(self, expression):
+        """Evaluate a BASIC expression."""
+        return self.compile_expression(expression).evaluate()
+
+    def compile_statement(self, command):
+        """Prepare BASIC statements for repeated execution."""
+        lines = []
         for cmd in command.splitlines():
             if isinstance(cmd, unicode):
                 cmd = self.codepage.str_from_unicode(cmd)
-            with self._handle_exceptions():
-                self._store_line(cmd)
-                self.interpreter.loop()
+            lines.append(_TokenCache(cmd))
+        return CompiledStatement(self, lines)
 
-    def evaluate(self, expression):
-        """Evaluate a BASIC expression."""
+    def compile_expression(self, expression):
+        """Prepare a BASIC expression for repeated evaluation."""
         if isinstance(expression, unicode):
             expression = self.codepage.str_from_unicode(expression)
-        with self._handle_exceptions():
-            # attach print token so tokeniser has a whole statement to work with
-            tokens = self.tokeniser.tokenise_line(b'?' + expression)
-            # skip : and print token and parse expression
-            tokens.read(2)
-            return self.parser.parse_expression(tokens).to_value()
-        return None
+        # attach print token so tokeniser has a whole statement to work with
+        return CompiledExpression(self, _TokenCache(b'?' + expression))
 
     def set_variable(self, name, value):
         """Set a variable in memory."""
@@ -304,6 +312,8 @@ class Session(object):
         # close files if we opened any
         self.files.close_all()
         self.devices.close()
+        # write out any buffered redirected output
+        self.output_redirection.flush()
 
     ###########################################################################
     # implementation
@@ -323,7 +333,11 @@ class Session(object):
         """Store a program line or schedule a command line for execution."""
         if not line:
             return True
-        self.interpreter.direct_line = self.tokeniser.tokenise_line(line)
+        return self._store_tokens(self.tokeniser.tokenise_line(line))
+
+    def _store_tokens(self, tokens):
+        """Store a tokenised program line or schedule a tokenised command line for execution."""
+        self.interpreter.direct_line = tokens
         c = self.interpreter.direct_line.peek()
         if c == '\0':
             # check for lines starting with numbers (6553 6) and empty lines
@@ -405,6 +419,23 @@ class Session(object):
                 # line edit gadget appears
                 self._edit_prompt = (self.program.get_line_number(e.pos), e.pos+1)
 
+    def _execute_tokens(self, lines):
+        """Execute command lines, tokenising each in turn on first use."""
+        for line in lines:
+            with self._handle_exceptions():
+                if line:
+                    self._store_tokens(line.get_stream(self.tokeniser))
+                self.interpreter.loop()
+
+    def _evaluate_tokens(self, statement):
+        """Evaluate the expression in a PRINT statement, tokenising it on first use."""
+        with self._handle_exceptions():
+            tokens = statement.get_stream(self.tokeniser)
+            # skip : and print token and parse expression
+            tokens.read(2)
+            return self.parser.parse_expression(tokens).to_value()
+        return None
+
     ###########################################################################
     # callbacks
 
@@ -806,3 +837,57 @@ class Session(object):
             if len(text) != 2:
                 raise error.RunError(error.IFC)
             self.basic_events.key[keynum-1].set_trigger(str(text))
+
+
+###############################################################################
+# compiled statements and expressions
+
+class _TokenCache(object):
+    """Line of BASIC code, tokenised when first run and kept for later runs."""
+
+    def __init__(self, line):
+        """Keep the line for tokenising."""
+        self._line = line
+        self._tokens = None
+
+    def __nonzero__(self):
+        """Line is not empty."""
+        return bool(self._line)
+
+    def get_stream(self, tokeniser):
+        """Create a fresh stream over the tokenised line."""
+        if self._tokens is None:
+            # tokenising may raise, e.g. on an overflowing &H literal; try again next time
+            self._tokens = tokeniser.tokenise_line(self._line).getvalue()
+        stream = codestream.TokenisedStream()
+        stream.write(self._tokens)
+        stream.seek(0)
+        return stream
+
+
+class CompiledStatement(object):
+    """BASIC statements, for repeated execution in a session."""
+
+    def __init__(self, session, lines):
+        """Keep the lines."""
+        self._session = session
+        self._lines = lines
+
+    def execute(self):
+        """Execute the statements."""
+        self._session._execute_tokens(self._lines)
+
+
+class CompiledExpression(object):
+    """BASIC expression, for repeated evaluation in a session."""
+
+    def __init__(self, session, statement):
+        """Keep the expression, as a PRINT statement."""
+        self._session = session
+        self._statement = statement
+
+    def evaluate(self):
+        """Evaluate the expression."""
+        # DEF FN and DEFtype are resolved while parsing the tokens,
+        # so their current definitions are always used
+        return self._session._evaluate_tokens(self._statement)
@@ -22,6 +22,7 @@ This file is released under the GNU GPL version 3.
 # The exponent is biased by 128.
 # There is an assumed 1 bit after the radix point (so the assumed mantissa is 0.1ffff... where f's are the fraction bits)
 
+import re
 import struct
 import math
 
@@ -34,6 +35,8 @@ from ..base import error
 BLANKS = b' \t\n'
 # ASCII separators - these cause string representations to evaluate to zero
 SEPARATORS = b'\x1c\x1d\x1f'
+# decimal representation without blanks: sign, digits, decimals, exponent or type sigil
+DECIMAL = re.compile(br'([+-]?)([0-9]*)(?:\.([0-9]*))?(?:([DEde])([+-]?)([0-9]*)|([!#]))?')
 
 
 
@@ -43,6 +46,8 @@ SEPARATORS = b'\x1c\x1d\x1f'
 class Value(object):
     """Abstract base class for value types."""
 
+    __slots__ = ('_buffer', '_values')
+
     sigil = None
     size = None
 
@@ -67,7 +72,7 @@ class Value(object):
 
     def clone(self):
         """Create a copy."""
-        return self.__class__(None, self._values).from_bytes(self._buffer)
+        return self.__class__(bytearray(self._buffer), self._values)
 
     def new(self):
         """Create a new null value."""
@@ -98,13 +103,19 @@ class Value(object):
 class Number(Value):
     """Abstract base class for numeric value."""
 
+    __slots__ = ('error_handler',)
+
     zero = None
     pos_max = None
     neg_max = None
 
     def __init__(self, buffer, values):
         """Initialise the number."""
-        Value.__init__(self, buffer, values)
+        # inlined from Value.__init__, as numbers are created for every intermediate result
+        if buffer is None:
+            buffer = bytearray(self.size)
+        self._buffer = memoryview(buffer)
+        self._values = values
         self.error_handler = values.error_handler
 
     def to_double(self):
@@ -130,6 +141,8 @@ class Number(Value):
 class Integer(Number):
     """16-bit signed little-endian integer."""
 
+    __slots__ = ()
+
     sigil = b'%'
     size = 2
 
@@ -279,16 +292,10 @@ class Integer(Number):
 
     def ineg(self):
         """Negate in-place."""
-        if self._buffer == '\x00\x80':
+        value = struct.unpack('<h', self._buffer)[0]
+        if value == -0x8000:
             raise error.RunError(error.OVERFLOW)
-        lsb = (ord(self._buffer[0]) ^ 0xff) + 1
-        msb = ord(self._buffer[1]) ^ 0xff
-        # apply carry
-        if lsb > 0xff:
-            lsb -= 0x100
-            msb += 1
-        # ignore overflow, since -0 == 0
-        self._buffer[:] = chr(lsb) + chr(msb & 0xff)
+        struct.pack_into('<h', self._buffer, 0, -value)
         return self
 
     def iabs(self):
@@ -298,23 +305,24 @@ class Integer(Number):
 
     def iadd(self, rhs):
         """Add another Integer in-place."""
-        lsb = ord(self._buffer[0]) + ord(rhs._buffer[0])
-        msb = ord(self._buffer[1]) + ord(rhs._buffer[1])
-        # apply carry
-        if lsb > 0xff:
-            lsb -= 0x100
-            msb += 1
-        # overflow if signs were equal and have changed
-        if (ord(self._buffer[1]) > 0x7f) == (ord(rhs._buffer[1]) > 0x7f) != (msb > 0x7f):
+        total = struct.unpack('<h', self._buffer)[0] + struct.unpack('<h', rhs._buffer)[0]
+        # overflow if the sum does not fit in a signed 16-bit int
+        if not -0x8000 <= total <= 0x7fff:
             raise error.RunError(error.OVERFLOW)
-        self._buffer[:] = chr(lsb) + chr(msb & 0xff)
+        struct.pack_into('<h', self._buffer, 0, total)
         return self
 
     def isub(self, rhs):
         """Subtract another Integer in-place."""
-        # we can't apply the neg on the lhs and avoid a copy
-        # because of things like -32768 - (-1)
-        return self.iadd(rhs.clone().ineg())
+        rhs_value = struct.unpack('<h', rhs._buffer)[0]
+        # negating the rhs overflows, even where the difference would fit
+        if rhs_value == -0x8000:
+            raise error.RunError(error.OVERFLOW)
+        total = struct.unpack('<h', self._buffer)[0] - rhs_value
+        if not -0x8000 <= total <= 0x7fff:
+            raise error.RunError(error.OVERFLOW)
+        struct.pack_into('<h', self._buffer, 0, total)
+        return self
 
     # no imul - we always promote to float first for multiplication
     # no idiv - we always promote to float first for true division
@@ -360,17 +368,7 @@ class Integer(Number):
         if isinstance(rhs, Float):
             # upgrade to Float
             return rhs.new().from_integer(self).gt(rhs)
-        isneg = ord(self._buffer[-1]) & 0x80
-        if isneg != (ord(rhs._buffer[-1]) & 0x80):
-            return not(isneg)
-        # compute the unsigned (not absolute!) >
-        lmsb = ord(self._buffer[1]) & 0x7f
-        rmsb = ord(rhs._buffer[1]) & 0x7f
-        if lmsb > rmsb:
-            return True
-        elif lmsb < rmsb:
-            return False
-        return ord(self._buffer[0]) > ord(rhs._buffer[0])
+        return struct.unpack('<h', self._buffer)[0] > struct.unpack('<h', rhs._buffer)[0]
 
     def eq(self, rhs):
         """Equals."""
@@ -386,6 +384,8 @@ class Integer(Number):
 class Float(Number):
     """Abstract base class for floating-point value."""
 
+    __slots__ = ()
+
     digits = None
     pos_max = None
     neg_max = None
@@ -628,18 +628,9 @@ class Float(Number):
 
     def to_decimal(self, digits=None):
         """Return value as mantissa and decimal exponent."""
-        if digits is None:
-            # we'd be better off storing these (and self._ten) in denormalised form
-            lim_bot = self.new().from_bytes(self._lim_bot)
-            lim_top = self.new().from_bytes(self._lim_top)
-            digits = self.digits
-        elif digits > 0:
-            lim_bot = self.new().from_int(10**(digits-1))._just_under()
-            lim_top = self.new().from_int(10**digits)._just_under()
-        else:
+        if digits is not None and digits <= 0:
             return 0, 0
-        tden = lim_top._denormalise()
-        bden = lim_bot._denormalise()
+        bden, tden = self._get_decimal_limits(digits)
         exp10 = 0
         den = self._denormalise()
         while self._abs_gt_den(den, tden):
@@ -783,6 +774,24 @@ class Float(Number):
     _ten = None
     _lim_bot = None
     _lim_top = None
+    # denormalised form of _ten
+    _ten_den = None
+    # denormalised decimal limits by number of digits
+    _decimal_limits = None
+
+    def _get_decimal_limits(self, digits):
+        """Denormalised highest floats less than 10**(digits-1) and 10**digits."""
+        try:
+            return self._decimal_limits[digits]
+        except KeyError:
+            if digits is None:
+                lim_bot = self.new().from_bytes(self._lim_bot)
+                lim_top = self.new().from_bytes(self._lim_top)
+            else:
+                lim_bot = self.new().from_int(10**(digits-1))._just_under()
+                lim_top = self.new().from_int(10**digits)._just_under()
+            limits = self._decimal_limits[digits] = lim_bot._denormalise(), lim_top._denormalise()
+            return limits
 
     def _apply_carry_den(self, den):
         """Round the carry byte (to be used only in to_decimal)."""
@@ -815,8 +824,7 @@ class Float(Number):
 
     def _div10_den(self, lden):
         """Divide by 10 in-place."""
-        exp, man, neg = self._div_den(lden,
-            self.new().from_bytes(self._ten)._denormalise())
+        exp, man, neg = self._div_den(lden, self._ten_den)
         # perhaps this should be in _div_den
         while man < self._den_mask:
             exp -= 1
@@ -992,13 +1000,28 @@ class Float(Number):
         # subtract exponentials
         lexp -= rexp - self._bias - 8
         # long division of mantissas
-        work_man = lman
-        lman = 0
-        lexp += 1
+        # the divisor is shifted right for each quotient bit and comparisons are strict
+        lexp += 1 - rman.bit_length()
+        if not rman or not 0 < lman <= rman << 1:
+            work_man = lman
+            lman = 0
+            while (rman > 0):
+                lman <<= 1
+                if work_man > rman:
+                    work_man -= rman
+                    lman += 1
+                rman >>= 1
+            return lexp, lman, lneg
+        # while the divisor's trailing zeros are shifted out it is exact,
+        # so these bits are an integer division; a strict comparison
+        # amounts to dividing one less than the dividend
+        exact = (rman & -rman).bit_length()
+        lman, work_man = divmod(lman - 1, rman >> (exact-1))
+        # carry on bit by bit once the divisor starts losing bits
+        rman >>= exact
         while (rman > 0):
             lman <<= 1
-            lexp -= 1
-            if work_man > rman:
+            if work_man >= rman:
                 work_man -= rman
                 lman += 1
             rman >>= 1
@@ -1012,6 +1035,8 @@ class Float(Number):
 class Single(Float):
     """Single-precision MBF float."""
 
+    __slots__ = ()
+
     sigil = b'!'
     size = 4
 
@@ -1038,6 +1063,8 @@ class Single(Float):
     _ten = b'\x00\x00\x20\x84'
     _lim_top = b'\x7f\x96\x18\x98' # 9999999, highest float less than 10e+7
     _lim_bot = b'\xff\x23\x74\x94' # 999999.9, highest float  less than 10e+6
+    _ten_den = (0x84, 0xa0000000, False)
+    _decimal_limits = {}
 
     def to_token(self):
         """Return value as Single token."""
@@ -1069,6 +1096,8 @@ class Single(Float):
 class Double(Float):
     """Double-precision MBF float."""
 
+    __slots__ = ()
+
     sigil = b'#'
     size = 8
 
@@ -1095,6 +1124,8 @@ class Double(Float):
     _ten = b'\x00\x00\x00\x00\x00\x00\x20\x84'
     _lim_top = b'\xff\xff\x03\xbf\xc9\x1b\x0e\xb6' # highest float less than 10e+16
     _lim_bot = b'\xff\xff\x9f\x31\xa9\x5f\x63\xb2' # highest float less than 10e+15
+    _ten_den = (0x84, 0xa000000000000000, False)
+    _decimal_limits = {}
 
     def from_single(self, in_single):
         """Convert Single to Double in-place."""
@@ -1138,6 +1169,10 @@ class Double(Float):
 
 def str_to_decimal(s, allow_nonnum=True):
     """Return Float value for Python string."""
+    # parsing stops at a type sigil; otherwise, only trailing whitespace may follow
+    match = DECIMAL.match(s)
+    if match.group(7) or not s[match.end():].strip(BLANKS):
+        return _match_to_decimal(match)
     found_sign, found_point, found_exp = False, False, False
     found_exp_sign, exp_neg, neg = False, False, False
     exp10, exponent, mantissa, digits, zeros = 0, 0, 0, 0, 0
@@ -1213,6 +1248,24 @@ def str_to_decimal(s, allow_nonnum=True):
         is_double = True
     return is_double, -mantissa if neg else mantissa, exp10
 
+def _match_to_decimal(match):
+    """Return Float value for a match of the DECIMAL pattern."""
+    sign, digitstr, decimals, exp_char, exp_sign, exp_digits, sigil = match.groups()
+    decimals = decimals or b''
+    mantissa = int(digitstr + decimals or b'0')
+    exp10 = -len(decimals)
+    if exp_digits:
+        exp10 += -int(exp_digits) if exp_sign == b'-' else int(exp_digits)
+    # precision digits start at the first nonzero digit; trailing decimal zeros don't count
+    digits = len((digitstr + decimals).lstrip(b'0'))
+    zeros = len(decimals) - len(decimals.rstrip(b'0')) if mantissa else 0
+    is_single = sigil == b'!'
+    is_double = sigil == b'#' or exp_char in (b'D', b'd')
+    # eight or more digits means double, unless single override
+    if digits - zeros > 7 and not is_single:
+        is_double = True
+    return is_double, -mantissa if sign == b'-' else mantissa, exp10
+
 def _get_digits(mantissa, n_digits, remove_trailing):
     """Get the digits for an int."""
     digitstr = str(abs(mantissa)).rjust(n_digits, '0')
@@ -17,6 +17,8 @@ from . import numbers
 class String(numbers.Value):
     """String pointer."""
 
+    __slots__ = ('_stringspace',)
+
     sigil = '$'
     size = 3
 
@@ -164,11 +164,16 @@ class FloatErrorHandler(object):
 class Values(object):
     """Handles BASIC strings and numbers."""
 
+    # maximum number of converted number representations to keep
+    max_cached_reprs = 1024
+
     def __init__(self, string_space, double_math):
         """Setup values."""
         self.stringspace = string_space
         # double-precision EXP, SIN, COS, TAN, ATN, LOG
         self.double_math = double_math
+        # number class and bytes by representation
+        self._reprs = {}
 
     def set_screen(self, screen):
         """Initialise the error message screen."""
@@ -252,6 +257,18 @@ class Values(object):
         word = word.lstrip(' \n').upper()
         if not word:
             return self.new_integer()
+        try:
+            number_class, number_bytes = self._reprs[word, allow_nonnum]
+        except KeyError:
+            number = self._number_from_repr(word, allow_nonnum)
+            if len(self._reprs) >= self.max_cached_reprs:
+                self._reprs.clear()
+            self._reprs[word, allow_nonnum] = number.__class__, number.to_bytes()
+            return number
+        return number_class(None, self).from_bytes(number_bytes)
+
+    def _number_from_repr(self, word, allow_nonnum):
+        """Convert upper-case representation to number."""
         if word[:2] == '&H':
             return self.new_integer().from_hex(word[2:])
         elif word[:1] == '&':
@@ -711,7 +711,8 @@ class Settings(object):
         except KeyError:
             pass
         else:
-            if os.path.isdir(arg_package):
+            # a directory given with --convert is a batch of programs, not a package
+            if os.path.isdir(arg_package) and u'convert' not in remaining:
                 os.chdir(arg_package)
                 remaining.pop(0)
                 package = arg_package
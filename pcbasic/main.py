@@ -5,7 +5,9 @@ PC-BASIC - GW-BASIC/BASICA/Cartridge BASIC compatible interpreter
 This file is released under the GNU GPL version 3 or later.
 """
 
+import os
 import sys
+import glob
 import locale
 import logging
 import pkgutil
@@ -13,6 +15,7 @@ import platform
 import traceback
 import threading
 import subprocess
+import multiprocessing
 from Queue import Queue
 
 # set locale - this is necessary for curses and *maybe* for clipboard handling
@@ -29,6 +32,8 @@ from . import config
 
 def main(*arguments):
     """Wrapper for run() to deal with Ctrl-C, stdio and pipes."""
+    # allow batch conversion processes in frozen Windows executables
+    multiprocessing.freeze_support()
     try:
         run(*arguments)
     except KeyboardInterrupt:
@@ -117,6 +122,10 @@ def show_platform_info():
 def convert(settings):
     """Perform file format conversion."""
     mode, name_in, name_out = settings.get_converter_parameters()
+    if name_in and (os.path.isdir(name_in) or
+                    (not os.path.exists(name_in) and glob.has_magic(name_in))):
+        convert_batch(settings, mode, name_in, name_out)
+        return
     session = basic.Session(**settings.get_session_parameters())
     try:
         session.load_program(name_in, rebuild_dict=False)
@@ -124,6 +133,96 @@ def convert(settings):
     except basic.RunError as e:
         logging.error(e.message)
 
+def convert_batch(settings, mode, name_in, dir_out):
+    """Convert all programs in a directory or matching a wildcard pattern."""
+    if not dir_out:
+        logging.error('Batch conversion needs an output directory.')
+        return
+    jobs = [(path_in, os.path.join(dir_out, rel_out), mode)
+            for path_in, rel_out in _find_programs(name_in)]
+    if not jobs:
+        logging.error('No programs found for %s', name_in)
+        return
+    session_params = settings.get_session_parameters()
+    failed = 0
+    processes = min(len(jobs), multiprocessing.cpu_count())
+    if processes > 1:
+        pool = multiprocessing.Pool(processes, _init_converter, (session_params,))
+        try:
+            # chunks keep each worker on one session and amortise the pipe overhead
+            chunksize = max(1, min(64, len(jobs) // (processes*4)))
+            for path_in, message in pool.imap_unordered(_convert_file, jobs, chunksize):
+                failed += _report_conversion(path_in, message)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        _init_converter(session_params)
+        for job in jobs:
+            failed += _report_conversion(*_convert_file(job))
+    if failed:
+        logging.error('%d of %d programs could not be converted.', failed, len(jobs))
+
+def _find_programs(name_in):
+    """Yield input paths and output paths relative to the output directory."""
+    if os.path.isdir(name_in):
+        for root, dirs, files in os.walk(name_in):
+            dirs.sort()
+            for name in sorted(files):
+                if os.path.splitext(name)[1].upper() == '.BAS':
+                    path = os.path.join(root, name)
+                    yield path, os.path.relpath(path, name_in)
+    else:
+        # keep the directory structure below the part of the pattern without wildcards
+        base = os.path.dirname(name_in)
+        while glob.has_magic(base):
+            base = os.path.dirname(base)
+        for path in sorted(glob.glob(name_in)):
+            if os.path.isfile(path):
+                yield path, os.path.relpath(path, base or os.curdir)
+
+# session held by each conversion process
+_converter_session = None
+
+def _init_converter(session_params):
+    """Create the session used for all conversions in this process."""
+    global _converter_session
+    _converter_session = basic.Session(**session_params)
+
+def _convert_file(job):
+    """Convert a single program file; return the name and any error message."""
+    path_in, path_out, mode = job
+    session = _converter_session
+    try:
+        dir_out = os.path.dirname(path_out)
+        if dir_out and not os.path.isdir(dir_out):
+            try:
+                os.makedirs(dir_out)
+            except EnvironmentError:
+                # may have been created by another worker in the meantime
+                if not os.path.isdir(dir_out):
+                    raise
+        # start from an empty buffer, as a new session would
+        # otherwise, the tail of a longer previous program is saved along with a bytecode file
+        session.program.bytecode.truncate(0)
+        with session.files.open_internal(path_in, filetype='ABP', mode='I') as progfile:
+            session.program.load(progfile, rebuild_dict=False)
+        with session.files.open_internal(path_out, filetype=mode, mode='O') as progfile:
+            session.program.save(progfile)
+    except basic.RunError as e:
+        return path_in, e.message
+    except EnvironmentError as e:
+        return path_in, e.strerror or str(e)
+    return path_in, None
+
+def _report_conversion(path_in, message):
+    """Log a failed conversion; return the number of failures."""
+    if message is None:
+        return 0
+    logging.error('%s: %s', path_in, message)
+    return 1
+
 def launch_session(settings):
     """Start an interactive interpreter session."""
     from . import interface
@@ -0,0 +1,99 @@
+#!/usr/bin/env python2
+"""
+PC-BASIC tests - test_cassette.py
+Finding files on tape through the header index
+
+(c) 2016 Rob Hagemans
+This file is released under the GNU GPL version 3 or later.
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from pcbasic.basic.base import error
+from pcbasic.basic import cassette
+
+
+class Screen(object):
+    """Stand-in for the screen; keeps the Found and Skipped messages."""
+
+    def __init__(self):
+        """Start with no messages."""
+        self.lines = []
+
+    def write_line(self, s):
+        """Keep a message."""
+        self.lines.append(s.split()[-1])
+
+
+class IndexTest(unittest.TestCase):
+    """Tape searches through the index only go forward."""
+
+    def setUp(self):
+        """Record two files on a new tape image."""
+        self._dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._dir)
+
+    def _record(self, ext):
+        """Record two files and return a freshly mounted tape."""
+        image = os.path.join(self._dir, 'TAPE.' + ext)
+        device = cassette.CASDevice(ext + ':' + image, Screen())
+        for name in ('ONE', 'TWO'):
+            f = device.open(1, name, 'D', 'O', None, None, 128, 0, 0, 0)
+            f.write('hello %s\r\n' % name)
+            f.close()
+        device.close()
+        device = cassette.CASDevice(ext + ':' + image, Screen())
+        self.addCleanup(device.close)
+        return device
+
+    def _open(self, device, name):
+        """Open a file for input and close it straight after the header."""
+        device.open(1, name, 'D', 'I', None, None, 128, 0, 0, 0).close()
+
+    def _assert_timeout(self, device, name):
+        """Assert that the file is not found on the rest of the tape."""
+        with self.assertRaises(error.RunError) as cm:
+            self._open(device, name)
+        self.assertEqual(cm.exception.err, error.DEVICE_TIMEOUT)
+
+    def _check_passed_header(self, ext):
+        """A file whose header has just been read is not found again."""
+        device = self._record(ext)
+        self._open(device, 'ONE')
+        self._assert_timeout(device, 'ONE')
+        self.assertEqual(device.screen.lines, ['Found.', 'Skipped.'])
+
+    def _check_end_of_tape(self, ext):
+        """A file before the last one is not found from the end of the tape."""
+        device = self._record(ext)
+        self._open(device, 'TWO')
+        self._assert_timeout(device, 'ONE')
+        # the tape is wound back to the start after a miss
+        self._open(device, 'ONE')
+        self.assertEqual(device.screen.lines, ['Skipped.', 'Found.', 'Found.'])
+
+    def test_cas_passed_header(self):
+        """CAS image: a passed header is not found again."""
+        self._check_passed_header('CAS')
+
+    def test_wav_passed_header(self):
+        """WAV image: a passed header is not found again."""
+        self._check_passed_header('WAV')
+
+    def test_cas_end_of_tape(self):
+        """CAS image: searching from the end of the tape times out."""
+        self._check_end_of_tape('CAS')
+
+    def test_wav_end_of_tape(self):
+        """WAV image: searching from the end of the tape times out."""
+        self._check_end_of_tape('WAV')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python2
+"""
+PC-BASIC tests - test_locks.py
+File sharing and record locking between processes
+
+(c) 2016 Rob Hagemans
+This file is released under the GNU GPL version 3 or later.
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from pcbasic.basic import Session
+
+
+def _session(path):
+    """Create a session with the Z: drive mounted on path."""
+    return Session(mount_dict={b'Z': (path, u'')}).attach()
+
+def _run_other(path, commands, result):
+    """Run commands in another process and send back ERR and A$."""
+    def target(queue):
+        session = _session(path)
+        session.execute(u'10 A$="-": E%=0: ON ERROR GOTO 100\n20 ' + commands + u'\n30 END\n100 E%=ERR: RESUME 30')
+        session.execute(u'RUN')
+        queue.put((session.get_variable(b'E%'), session.get_variable(b'A$')))
+        session.close()
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=target, args=(queue,))
+    process.start()
+    result.extend(queue.get(timeout=30))
+    process.join()
+
+
+class LocksTest(unittest.TestCase):
+    """Locks held by one interpreter as seen from another process."""
+
+    def setUp(self):
+        """Create a scratch directory and a session working in it."""
+        self._dir = tempfile.mkdtemp()
+        self._session = _session(self._dir)
+        self._session.execute(u'OPEN "SEQ.TXT" FOR OUTPUT AS 1: PRINT #1, "hello": CLOSE 1')
+
+    def tearDown(self):
+        """Close the session and clean up."""
+        self._session.close()
+        shutil.rmtree(self._dir)
+
+    def test_default_mode(self):
+        """Files open in default mode can be read by another process."""
+        self._session.execute(u'OPEN "SEQ.TXT" FOR INPUT AS 1')
+        result = []
+        _run_other(self._dir, u'OPEN "SEQ.TXT" FOR INPUT AS 1: LINE INPUT #1, A$: CLOSE', result)
+        self.assertEqual(result, [0, b'hello'])
+
+    def test_default_holds_nothing(self):
+        """Files open in default mode don't keep out LOCK READ WRITE from another process."""
+        self._session.execute(u'OPEN "SEQ.TXT" FOR INPUT AS 1')
+        result = []
+        _run_other(self._dir, u'OPEN "SEQ.TXT" FOR RANDOM LOCK READ WRITE AS 1: A$="open"', result)
+        self.assertEqual(result, [0, b'open'])
+
+    def test_default_refused(self):
+        """Default-mode output is refused while another process holds LOCK READ WRITE."""
+        self._session.execute(u'OPEN "SEQ.TXT" FOR RANDOM LOCK READ WRITE AS 1')
+        result = []
+        _run_other(self._dir, u'OPEN "SEQ.TXT" FOR OUTPUT AS 1: A$="open"', result)
+        self.assertEqual(result, [70, b'-'])
+        # the file was not truncated
+        self.assertEqual(os.path.getsize(os.path.join(self._dir, 'SEQ.TXT')), 8)
+
+    def test_default_refused_shared(self):
+        """Default-mode output is refused while another process has the file SHARED."""
+        self._session.execute(u'OPEN "SEQ.TXT" FOR RANDOM SHARED AS 1 LEN=4: LOCK #1, 1')
+        result = []
+        _run_other(self._dir, u'OPEN "SEQ.TXT" FOR OUTPUT AS 1: A$="open"', result)
+        self.assertEqual(result, [70, b'-'])
+        self.assertEqual(os.path.getsize(os.path.join(self._dir, 'SEQ.TXT')), 8)
+
+    def test_lock_read_write(self):
+        """LOCK READ WRITE keeps other processes out."""
+        self._session.execute(u'OPEN "SEQ.TXT" FOR RANDOM LOCK READ WRITE AS 1')
+        result = []
+        _run_other(self._dir, u'OPEN "SEQ.TXT" FOR RANDOM SHARED AS 1: A$="open"', result)
+        self.assertEqual(result, [70, b'-'])
+
+    def test_shared(self):
+        """SHARED files can be opened SHARED by another process."""
+        self._session.execute(u'OPEN "SEQ.TXT" FOR RANDOM SHARED AS 1')
+        result = []
+        _run_other(self._dir, u'OPEN "SEQ.TXT" FOR RANDOM SHARED AS 1: A$="open"', result)
+        self.assertEqual(result, [0, b'open'])
+
+    def test_record_lock(self):
+        """A locked record can't be read by another process."""
+        self._session.execute(u'OPEN "SEQ.TXT" FOR RANDOM SHARED AS 1 LEN=4: LOCK #1, 1')
+        result = []
+        _run_other(self._dir,
+                u'OPEN "SEQ.TXT" FOR RANDOM SHARED AS 1 LEN=4: FIELD #1, 4 AS F$: '
+                u'GET #1, 2: A$=F$: GET #1, 1: A$="read"', result)
+        self.assertEqual(result, [70, b'o\r\n\x1a'])
+
+    def test_record_lock_after_growth(self):
+        """A locked record stays locked when another process extends the file."""
+        self._session.execute(u'OPEN "SEQ.TXT" FOR RANDOM SHARED AS 1 LEN=4: FIELD #1, 4 AS F$: LOCK #1, 1')
+        grow = (u'OPEN "SEQ.TXT" FOR RANDOM SHARED AS 1 LEN=4: FIELD #1, 4 AS F$: '
+                u'LSET F$="grow": PUT #1, %d: A$="grown"')
+        overwrite = (u'OPEN "SEQ.TXT" FOR RANDOM SHARED AS 1 LEN=4: FIELD #1, 4 AS F$: '
+                u'LSET F$="over": PUT #1, 1: A$="written"')
+        # read beyond the old end of the file
+        result = []
+        _run_other(self._dir, grow % 5, result)
+        self._session.execute(u'GET #1, 5')
+        self.assertEqual(self._session.get_variable(b'F$'), b'grow')
+        _run_other(self._dir, overwrite, result)
+        # see the new length
+        _run_other(self._dir, grow % 50, result)
+        self._session.execute(u'L = LOF(1)')
+        # PUT writes out the whole field buffer, so the file is 196 + 128 bytes long
+        self.assertEqual(self._session.get_variable(b'L!'), 324)
+        _run_other(self._dir, overwrite, result)
+        self.assertEqual(result, [0, b'grown', 70, b'-', 0, b'grown', 70, b'-'])
+
+    def test_file_mode(self):
+        """Created files have the usual permissions."""
+        umask = os.umask(0o22)
+        try:
+            self._session.execute(u'OPEN "NEW.DAT" FOR RANDOM SHARED AS 1: CLOSE 1')
+        finally:
+            os.umask(umask)
+        self.assertEqual(os.stat(os.path.join(self._dir, 'NEW.DAT')).st_mode & 0o777, 0o644)
+
+    def test_input_not_created(self):
+        """Locked input from a missing file doesn't create it."""
+        self._session.execute(u'OPEN "NONE.TXT" FOR INPUT LOCK READ AS 1')
+        self.assertFalse(os.path.exists(os.path.join(self._dir, 'NONE.TXT')))
+
+
+if __name__ == '__main__':
+    unittest.main()
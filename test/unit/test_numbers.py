@@ -0,0 +1,82 @@
+#!/usr/bin/env python2
+"""
+PC-BASIC tests - test_numbers.py
+Integer arithmetic at the ends of the range
+
+(c) 2016 Rob Hagemans
+This file is released under the GNU GPL version 3 or later.
+"""
+
+import sys
+import os
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from pcbasic.basic.base import error
+from pcbasic.basic.values import numbers
+
+
+class Values(object):
+    """Stand-in for the value handler; integer arithmetic doesn't use it."""
+
+    error_handler = None
+
+
+class IntegerTest(unittest.TestCase):
+    """Integer add, subtract and negate."""
+
+    def _int(self, value):
+        """Create an Integer."""
+        return numbers.Integer(None, Values()).from_int(value)
+
+    def _assert_overflow(self, func, *args):
+        """Assert that the operation raises Overflow."""
+        with self.assertRaises(error.RunError) as cm:
+            func(*args)
+        self.assertEqual(cm.exception.err, error.OVERFLOW)
+
+    def test_add(self):
+        """Sums in range, including those that carry out of the high byte."""
+        self.assertEqual(self._int(-32760).iadd(self._int(-8)).to_int(), -32768)
+        self.assertEqual(self._int(-1).iadd(self._int(-1)).to_int(), -2)
+        self.assertEqual(self._int(32766).iadd(self._int(1)).to_int(), 32767)
+        self.assertEqual(self._int(-32768).iadd(self._int(32767)).to_int(), -1)
+
+    def test_add_overflow(self):
+        """Sums out of range overflow, in either direction."""
+        self._assert_overflow(self._int(32767).iadd, self._int(1))
+        self._assert_overflow(self._int(-32768).iadd, self._int(-1))
+        # carry out of the high byte with the sign bit clear
+        self._assert_overflow(self._int(-32768).iadd, self._int(-4))
+        self._assert_overflow(self._int(-32768).iadd, self._int(-32768))
+
+    def test_sub(self):
+        """Differences in range."""
+        self.assertEqual(self._int(-32767).isub(self._int(1)).to_int(), -32768)
+        self.assertEqual(self._int(-32768).isub(self._int(-1)).to_int(), -32767)
+        self.assertEqual(self._int(32767).isub(self._int(32767)).to_int(), 0)
+
+    def test_sub_overflow(self):
+        """Subtracting -32768 overflows, even where the difference would fit."""
+        self._assert_overflow(self._int(-32768).isub, self._int(1))
+        self._assert_overflow(self._int(32767).isub, self._int(-1))
+        self._assert_overflow(self._int(-1).isub, self._int(-32768))
+        self._assert_overflow(self._int(-32768).isub, self._int(-32768))
+
+    def test_neg(self):
+        """Negating -32768 overflows."""
+        self.assertEqual(self._int(32767).ineg().to_int(), -32767)
+        self.assertEqual(self._int(0).ineg().to_int(), 0)
+        self._assert_overflow(self._int(-32768).ineg)
+
+    def test_gt(self):
+        """Comparison across the sign boundary."""
+        self.assertTrue(self._int(1).gt(self._int(-1)))
+        self.assertTrue(self._int(-1).gt(self._int(-32768)))
+        self.assertFalse(self._int(-32768).gt(self._int(32767)))
+        self.assertFalse(self._int(5).gt(self._int(5)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python2
+"""
+PC-BASIC tests - test_ports.py
+Serial port reader thread and port output on standard I/O
+
+(c) 2016 Rob Hagemans
+This file is released under the GNU GPL version 3 or later.
+"""
+
+import sys
+import os
+import socket
+import select
+import time
+import io
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from pcbasic.basic import ports
+from pcbasic.basic import redirect
+
+
+class InputMethods(object):
+    """Stand-in for the input methods; lets the interpreter wait."""
+
+    def wait(self):
+        """Wait a tick."""
+        time.sleep(0.001)
+
+
+class COMStdIOTest(unittest.TestCase):
+    """COM port attached to STDIO, with stdin replaced by one end of a socket pair."""
+
+    def setUp(self):
+        """Attach the port to a socket pair."""
+        self._ours, theirs = socket.socketpair()
+        self._stdin, sys.stdin = sys.stdin, theirs.makefile('rb', 0)
+        theirs.close()
+        # cleanups run last-in first-out, so files opened in the test are closed first
+        self.addCleanup(self._restore)
+        self._device = ports.COMDevice(b'STDIO:', InputMethods(), None, 16)
+
+    def _restore(self):
+        """Restore stdin."""
+        sys.stdin.close()
+        sys.stdin = self._stdin
+        self._ours.close()
+
+    def _open(self, mode):
+        """Open a file on the port, closed after the test."""
+        f = self._device.open(1, b'', b'D', mode, b'', b'', 128, 0, 0, 0)
+        self.addCleanup(f.close)
+        return f
+
+    def _wait_for(self, f, num):
+        """Wait until the input buffer holds num chars."""
+        for _ in range(100):
+            if f.loc() >= num:
+                break
+            time.sleep(0.01)
+        return f.loc()
+
+    def test_input(self):
+        """Input arrives in the buffer without reading the port."""
+        f = self._open(b'I')
+        self._ours.sendall(b'hello')
+        self.assertEqual(self._wait_for(f, 5), 5)
+        self.assertTrue(self._device.char_waiting())
+        self.assertEqual(f.read_raw(5), b'hello')
+
+    def test_overflow(self):
+        """Input that doesn't fit in the buffer is dropped."""
+        f = self._open(b'I')
+        self._ours.sendall(b'x' * 20)
+        self.assertEqual(self._wait_for(f, 16), 16)
+        time.sleep(0.2)
+        self.assertEqual(f.loc(), 16)
+        self.assertTrue(f.overflow)
+
+    def test_output_only(self):
+        """Files opened for output leave input alone."""
+        f = self._open(b'O')
+        self._ours.sendall(b'hello')
+        time.sleep(0.2)
+        self.assertTrue(select.select([sys.stdin], [], [], 0)[0])
+
+    def test_close(self):
+        """Closing the file stops the reader and deregisters the file."""
+        f = self._open(b'I')
+        reader = f._reader
+        self.assertTrue(reader.is_alive())
+        f.close()
+        self.assertFalse(reader.is_alive())
+        self.assertIsNone(self._device._open_file)
+        self.assertFalse(self._device.char_waiting())
+        # input after close is left for the next reader
+        self._ours.sendall(b'hello')
+        time.sleep(0.2)
+        self.assertTrue(select.select([sys.stdin], [], [], 0)[0])
+
+    def test_end_of_input(self):
+        """End of input doesn't hang the reader."""
+        f = self._open(b'I')
+        self._ours.sendall(b'hi')
+        self._ours.shutdown(socket.SHUT_WR)
+        self.assertEqual(self._wait_for(f, 2), 2)
+        start = time.time()
+        f.close()
+        self.assertLess(time.time() - start, 1.)
+
+
+class StdIOOrderTest(unittest.TestCase):
+    """Port output on stdout stays behind the buffered screen echo."""
+
+    def setUp(self):
+        """Replace stdout and echo the screen to it through a redirection buffer."""
+        self._stdout, sys.stdout = sys.stdout, io.BytesIO()
+        self.addCleanup(self._restore)
+        self._redirect = redirect.OutputRedirection(None, False, sys.stdout)
+
+    def _restore(self):
+        """Restore stdout."""
+        sys.stdout = self._stdout
+
+    def test_lpt(self):
+        """Printer output comes after earlier screen output."""
+        device = ports.LPTDevice(b'STDIO:', None, 'line', None, None, self._redirect)
+        self._redirect.write(b'first screen line\r\n')
+        device.device_file.write(b'printed line\r\n')
+        self._redirect.write(b'second screen line\r\n')
+        self._redirect.flush()
+        self.assertEqual(sys.stdout.getvalue(),
+            b'first screen line\r\nprinted line\r\nsecond screen line\r\n')
+
+    def test_com(self):
+        """Serial output comes after earlier screen output."""
+        device = ports.COMDevice(b'STDIO:', InputMethods(), None, 16, self._redirect)
+        self._redirect.write(b'screen ')
+        f = device.open(1, b'', b'D', b'O', b'', b'', 128, 0, 0, 0)
+        f.write(b'port')
+        f.close()
+        self.assertEqual(sys.stdout.getvalue(), b'screen port')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python2
+"""
+PC-BASIC tests - test_session.py
+Compiled statement and expression handles
+
+(c) 2016 Rob Hagemans
+This file is released under the GNU GPL version 3 or later.
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from pcbasic.basic import Session
+
+
+class CompiledTest(unittest.TestCase):
+    """Statements and expressions compiled once and run repeatedly."""
+
+    def setUp(self):
+        """Create a session with screen output copied to a file."""
+        self._dir = tempfile.mkdtemp()
+        self._output = os.path.join(self._dir, 'OUTPUT.TXT')
+        self._session = Session(output_file=self._output).attach()
+
+    def tearDown(self):
+        """Close the session and clean up."""
+        self._session.close()
+        shutil.rmtree(self._dir)
+
+    def _get_output(self):
+        """Get the screen output so far, as a list of lines."""
+        self._session.output_redirection.flush()
+        with open(self._output, 'rb') as f:
+            # drop trailing spaces and the \xff that follows error messages
+            return [line.rstrip(b' \xff') for line in f.read().split(b'\r\n') if line.strip()]
+
+    def test_statement(self):
+        """Statements run on every execution."""
+        increment = self._session.compile_statement(u'A% = A% + 1\nB% = B% + A%')
+        for _ in range(3):
+            increment.execute()
+        self.assertEqual(self._session.get_variable(b'A%'), 3)
+        self.assertEqual(self._session.get_variable(b'B%'), 6)
+
+    def test_expression(self):
+        """Expressions see the current variables."""
+        double = self._session.compile_expression(u'A% * 2')
+        self._session.set_variable(b'A%', 3)
+        self.assertEqual(double.evaluate(), 6)
+        self._session.set_variable(b'A%', 5)
+        self.assertEqual(double.evaluate(), 10)
+
+    def test_def_fn(self):
+        """Expressions use the current DEF FN definition."""
+        fn = self._session.compile_expression(u'FNA(2)')
+        self._session.execute(u'10 DEF FNA(X) = X * 2\nRUN')
+        self.assertEqual(fn.evaluate(), 4)
+        self._session.execute(u'10 DEF FNA(X) = X * 3\nRUN')
+        self.assertEqual(fn.evaluate(), 6)
+
+    def test_statement_error(self):
+        """An error in one line is reported in turn and the next line runs."""
+        statement = self._session.compile_statement(u'PRINT "four"\nPRINT &H1FFFF\nPRINT "six"')
+        statement.execute()
+        statement.execute()
+        self.assertEqual(self._get_output(), [b'four', b'Overflow', b'six'] * 2)
+
+    def test_soft_error_order(self):
+        """Warnings while tokenising a line come after the output of earlier lines."""
+        self._session.execute(u'PRINT "one"\nPRINT 1E99')
+        self.assertEqual(self._get_output(), [b'one', b'Overflow', b' 1.701412E+38'])
+
+    def test_expression_error(self):
+        """An expression that doesn't tokenise gives None and an error message."""
+        expression = self._session.compile_expression(u'&H1FFFF')
+        self.assertIsNone(expression.evaluate())
+        self.assertIsNone(expression.evaluate())
+        self.assertIsNone(self._session.evaluate(u'1/0 + &H1FFFF'))
+        self.assertEqual(self._get_output(), [b'Overflow'] * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()